@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import User, Game
+from .models import User, Game, Seat, Tournament, TournamentEntry
 
 admin.site.register(User)
 admin.site.register(Game)
+admin.site.register(Seat)
+admin.site.register(Tournament)
+admin.site.register(TournamentEntry)
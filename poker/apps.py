@@ -0,0 +1,28 @@
+import logging
+import os
+import time
+
+from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PokerConfig(AppConfig):
+    name = "poker"
+
+    def ready(self):
+        """warms up the game state cache from the last snapshot, if any."""
+        from poker import snapshot
+
+        path = getattr(settings, "GAME_SNAPSHOT_PATH", None)
+        if not path or not os.path.exists(path):
+            return
+        start = time.time()
+        try:
+            count = snapshot.load(path)
+        except (snapshot.SnapshotError, EnvironmentError):
+            # a warm start is nice to have, games are read the usual way without it.
+            logger.exception("can't load the game snapshot %s", path)
+            return
+        logger.info("loaded %d games from %s in %.1fms", count, path, 1000 * (time.time() - start))
@@ -0,0 +1,225 @@
+"""server side bot players
+
+bots fill up tables which have been waiting for players too long
+and act through Game.record_action like everyone else.
+their decisions run on a small pool of worker threads, so request workers
+only ever hand a decision over and move on. at most BOT_QUEUE_SIZE
+decisions wait for the workers, beyond that a bot is left to be handed
+over again by a later poll of its game(see views._is_unchanged).
+the worker threads mostly wait on the database, the cpu bound part,
+estimating the equity of the bot's hand, runs in a pool of processes
+so it doesn't hold the GIL the request threads need.
+every decision gets a strict time budget for estimating the equity,
+estimates are cached since the same spots(pocket cards, board and
+number of opponents) come up all the time.
+
+settings:
+    BOT_FILL_DELAY: seconds an Initial table waits before bots sit down.
+    BOT_POOL_SIZE: number of decision workers, 0 decides in the caller's
+        thread which is handy for tests.
+    BOT_QUEUE_SIZE: most decisions handed over and not done yet.
+    BOT_EQUITY_PROCESSES: number of processes estimating equities,
+        0 estimates in the worker thread itself.
+    BOT_DECISION_BUDGET: seconds a bot may think about a decision.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from poker.handeval import estimate_equity
+from poker.models import BettingStatus, FrenchDeck, Game, GameStages, MIN_PLAYERS_TO_START
+from poker.querybudget import uncounted
+
+logger = logging.getLogger(__name__)
+
+# bot guids are as long as uuids, so they fit wherever a user guid does.
+BOT_GUID_PREFIX = "bot-"
+# number of equity estimates kept around.
+EQUITY_CACHE_SIZE = 10000
+# seconds an estimate may take on top of its deadline, to get in
+# and out of its process. the estimate itself stops at the deadline.
+EQUITY_TIMEOUT_MARGIN = 0.005
+
+_pool = None
+_pool_lock = threading.Lock()
+# NOTE: the processes are forked on first use, from a process with threads
+#       running, they only ever run handeval.estimate_equity.
+_equity_pool = None
+_equity_cache = OrderedDict()
+_equity_cache_lock = threading.Lock()
+# (game pk, game version) of the decisions handed over to the workers,
+# a game polled many times while a bot thinks is only decided once.
+# NOTE: entries are only added once the transaction handing the decision
+#       over has committed, a rolled back one never leaves one behind.
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def new_bot_guid():
+    return BOT_GUID_PREFIX + uuid.uuid4().hex
+
+
+def is_bot(user_guid):
+    return bool(user_guid) and user_guid.startswith(BOT_GUID_PREFIX)
+
+
+def needs_bots(game):
+    """
+    True if the game is Initial and has been waiting for players longer
+        than BOT_FILL_DELAY. tournament tables never need bots.
+    """
+    delay = timedelta(seconds=getattr(settings, "BOT_FILL_DELAY", 30))
+    return game.stage == GameStages.Initial and game.tournament_id is None and \
+        game.total_num_of_players < MIN_PLAYERS_TO_START and \
+        timezone.now() - game.created >= delay
+
+
+def fill_with_bots(game):
+    """
+    seats bots at a game which needs them(see needs_bots), so it can start.
+    the game is not saved, that's up to the caller.
+    returns True if any bot sat down.
+    """
+    if not needs_bots(game):
+        return False
+    while game.total_num_of_players < MIN_PLAYERS_TO_START:
+        bot_guid = new_bot_guid()
+        game.player_guids = "|".join(
+            [x for x in game.player_guids.split("|") if x] + [bot_guid])
+        game.total_num_of_players += 1
+    return True
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, "BOT_POOL_SIZE", 4))
+        return _pool
+
+
+def _get_equity_pool():
+    global _equity_pool
+    with _pool_lock:
+        if _equity_pool is None:
+            _equity_pool = multiprocessing.Pool(getattr(settings, "BOT_EQUITY_PROCESSES", 2))
+        return _equity_pool
+
+
+def play_if_bot_to_act(game):
+    """
+    hands the decision over to the bot workers if it's a bot's turn,
+        once the current transaction(if any) has committed
+        so the worker sees the game as it is now.
+    """
+    if not is_bot(game.player_to_action) or \
+            game.stage in (GameStages.Initial, GameStages.GameOver):
+        return
+    args = (game.pk, game.player_to_action, game.version)
+    transaction.on_commit(lambda: _hand_over(*args))
+
+
+def _hand_over(game_pk, bot_guid, version):
+    """
+    queues the decision for the workers, unless it's queued already
+        or the queue is full. with BOT_POOL_SIZE 0 decides right away,
+        the bot's work is not counted against the caller's query budget.
+    """
+    with _pending_lock:
+        if (game_pk, version) in _pending or \
+                len(_pending) >= getattr(settings, "BOT_QUEUE_SIZE", 100):
+            return
+        _pending.add((game_pk, version))
+    if getattr(settings, "BOT_POOL_SIZE", 4) == 0:
+        with uncounted():
+            _act(game_pk, bot_guid, version)
+    else:
+        _get_pool().apply_async(_act, (game_pk, bot_guid, version))
+
+
+def _act(game_pk, bot_guid, version):
+    """a bot worker's job: decide and act for bot_guid, if still its turn."""
+    try:
+        with transaction.atomic():
+            game = Game.objects.select_for_update().get(pk=game_pk)
+            if game.version != version or game.player_to_action != bot_guid:
+                # somebody else acted in the meantime.
+                return
+            action_type, amount = decide(game, bot_guid)
+            game.record_action(bot_guid, action_type, amount)
+            game = game.move_to_next_stage_if_ready()
+            play_if_bot_to_act(game)
+    except Exception:
+        logger.exception("bot %s failed to act in game %s", bot_guid, game_pk)
+    finally:
+        with _pending_lock:
+            _pending.discard((game_pk, version))
+        if getattr(settings, "BOT_POOL_SIZE", 4) != 0:
+            # worker threads are not request threads, nobody else
+            # would clean up their database connection.
+            close_old_connections()
+
+
+def _cached_equity(pocket, community, num_opponents, deadline):
+    key = (tuple(sorted(pocket)), tuple(sorted(community)), num_opponents)
+    with _equity_cache_lock:
+        if key in _equity_cache:
+            return _equity_cache[key]
+    args = (pocket, community, num_opponents, FrenchDeck.DECK_52, deadline)
+    if getattr(settings, "BOT_EQUITY_PROCESSES", 2) == 0:
+        equity, samples = estimate_equity(*args)
+    else:
+        try:
+            equity, samples = _get_equity_pool().apply_async(estimate_equity, args).get(
+                max(deadline - time.time(), 0) + EQUITY_TIMEOUT_MARGIN)
+        except multiprocessing.TimeoutError:
+            # the processes are all busy, the bot plays an average hand.
+            return 1.0 / (num_opponents + 1)
+    with _equity_cache_lock:
+        _equity_cache[key] = equity
+        if len(_equity_cache) > EQUITY_CACHE_SIZE:
+            _equity_cache.popitem(last=False)
+    return equity
+
+
+def decide(game, bot_guid):
+    """
+    returns (action_type, amount) for the bot, based on the equity of its hand
+        against the players still in and the price of staying in.
+    """
+    deadline = time.time() + getattr(settings, "BOT_DECISION_BUDGET", 0.05)
+    position = game._get_player_index(bot_guid)
+    seats = dict(
+        (x, (chips, round_bet, hand_bet)) for x, chips, round_bet, hand_bet in
+        game.seats.values_list("position", "chips", "round_bet", "hand_bet"))
+    chips, round_bet, _ = seats[position]
+    to_call = max(s[1] for s in seats.values()) - round_bet
+    pot = sum(s[2] for s in seats.values())
+    # folds are kept for the whole hand.
+    num_opponents = len([
+        x for x, status in enumerate(game.betting_status)
+        if x != position and status != BettingStatus.Fold])
+    if not num_opponents:
+        return BettingStatus.Call_Or_Check, 0
+
+    pocket = game.get_user_pocket_cards(bot_guid).split("|")
+    community = [x for x in game.community_cards.split("|") if x]
+    equity = _cached_equity(pocket, community, num_opponents, deadline)
+
+    if equity > 1.5 / (num_opponents + 1) and chips > to_call:
+        # clearly better than an average hand: raise half the pot.
+        return BettingStatus.Reraise, min(chips, to_call + max(pot // 2, 1))
+    if to_call == 0 or equity >= float(to_call) / (pot + to_call):
+        # checking is free, calling is worth the price.
+        return BettingStatus.Call_Or_Check, 0
+    return BettingStatus.Fold, 0
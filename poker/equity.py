@@ -0,0 +1,222 @@
+"""range vs range equity
+
+equity_progress() yields estimates which get better over time:
+first quick monte carlo estimates, sampled in doubling batches straight
+from the ranges, then, when it's affordable, the exact equity from
+enumerating every runout, reported as it comes in.
+
+to keep the work down:
+    combos holding a dead card(the board, or the other player's cards)
+        never meet,
+    matchups which are the same up to a renaming of the suits,
+        e.g. AhKh vs QsQc and AsKs vs QhQc on an empty board,
+        are enumerated once and weighted by how many there are,
+    the enumeration is spread over EQUITY_PROCESSES processes.
+
+an exact answer needs at most MATCHUP_LIMIT matchups(hero combos times
+villain combos) and at most EXACT_EVALUATION_LIMIT hands to score
+(matchup classes times runouts). that's most turn and river spots,
+but only narrow ranges on the flop: "QQ+, AKs" vs "any pair" on a rainbow
+flop is 1332 classes times 990 runouts, which stays monte carlo,
+as does every preflop spot.
+"""
+
+import itertools
+import multiprocessing
+import random
+import threading
+
+from poker.handeval import score_hand
+from poker.models import FrenchDeck
+from poker.ranges import DECK
+
+# processes enumerating runouts.
+EQUITY_PROCESSES = max(multiprocessing.cpu_count() - 1, 1)
+# the most hands scored for an exact answer, beyond that
+# monte carlo estimates are all there is.
+EXACT_EVALUATION_LIMIT = 400000
+# the most matchups(pairs of combos) classified for an exact answer,
+# beyond that the ranges are too wide and it's monte carlo only.
+MATCHUP_LIMIT = 20000
+# monte carlo samples of the first estimate, doubling every time after.
+FIRST_SAMPLES = 250
+# the most monte carlo samples, when there is no exact answer to wait for.
+MAX_SAMPLES = 64000
+# monte carlo samples taken before the exact enumeration starts.
+SAMPLES_BEFORE_EXACT = 2000
+
+_SUIT_PERMUTATIONS = [
+    dict(zip(FrenchDeck.suits, permutation))
+    for permutation in itertools.permutations(FrenchDeck.suits)]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class EquityError(ValueError):
+    """the equity can't be worked out for these ranges."""
+    pass
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.Pool(EQUITY_PROCESSES)
+        return _pool
+
+
+def _canonical(hero, villain, board):
+    """the same key for every matchup which only differs by the names of the suits."""
+    keys = []
+    for suits in _SUIT_PERMUTATIONS:
+        keys.append(tuple(
+            tuple(sorted(suits[card[0]] + card[1:] for card in cards))
+            for cards in (hero, villain, board)))
+    return min(keys)
+
+
+def check_ranges(hero_combos, villain_combos):
+    """
+    raises EquityError unless some combo of hero's range can meet one of villain's.
+    NOTE: cheap, ranges which can't meet are tiny, a combo shares a card
+          with 101 others at most.
+    """
+    for hero in hero_combos:
+        for villain in villain_combos:
+            if hero[0] not in villain and hero[1] not in villain:
+                return
+    raise EquityError("The ranges can't meet, every matchup shares a card.")
+
+
+def matchup_classes(hero_combos, villain_combos, board):
+    """
+    returns [(hero combo, villain combo, weight)], one per class of
+        matchups equal up to suits, weight being the size of the class.
+    """
+    classes = {}
+    for hero in hero_combos:
+        for villain in villain_combos:
+            if hero[0] in villain or hero[1] in villain:
+                continue
+            key = _canonical(hero, villain, board)
+            if key in classes:
+                classes[key][2] += 1
+            else:
+                classes[key] = [hero, villain, 1]
+    return [tuple(x) for x in classes.values()]
+
+
+def _showdown(hero, villain, board):
+    """hero's share of the pot: 1, 0.5 or 0."""
+    hero_score = score_hand(list(hero) + board)
+    villain_score = score_hand(list(villain) + board)
+    if hero_score > villain_score:
+        return 1.0
+    if hero_score == villain_score:
+        return 0.5
+    return 0.0
+
+
+def _enumerate(args):
+    """
+    hero's equity in a matchup over every possible runout, with the matchup's weight.
+    runs in the pool's processes.
+    """
+    hero, villain, board, weight = args
+    dead = set(hero) | set(villain) | set(board)
+    remaining = [card for card in DECK if card not in dead]
+    total = 0.0
+    runouts = 0
+    for runout in itertools.combinations(remaining, 5 - len(board)):
+        total += _showdown(hero, villain, list(board) + list(runout))
+        runouts += 1
+    return total / runouts, weight
+
+
+def _num_runouts(board):
+    num_left = len(DECK) - 4 - len(board)
+    needed = 5 - len(board)
+    count = 1
+    for x in range(0, needed):
+        count = count * (num_left - x) // (x + 1)
+    return count
+
+
+def _sample(hero_combos, villain_combos, board, num_of_samples):
+    """
+    sum of hero's share over num_of_samples random matchups and runouts,
+        every matchup of combos which can meet is as likely.
+    """
+    total = 0.0
+    num_sampled = 0
+    while num_sampled < num_of_samples:
+        hero = random.choice(hero_combos)
+        villain = random.choice(villain_combos)
+        if hero[0] in villain or hero[1] in villain:
+            continue
+        num_sampled += 1
+        dead = set(hero) | set(villain) | set(board)
+        remaining = [card for card in DECK if card not in dead]
+        total += _showdown(hero, villain, list(board) + random.sample(remaining, 5 - len(board)))
+    return total
+
+
+def _monte_carlo(hero_combos, villain_combos, board):
+    """yields monte carlo estimates in doubling batches, up to MAX_SAMPLES samples."""
+    total = 0.0
+    samples = 0
+    batch = FIRST_SAMPLES
+    while samples < MAX_SAMPLES:
+        total += _sample(hero_combos, villain_combos, board, batch)
+        samples += batch
+        yield {"equity": total / samples, "samples": samples, "exact": False}
+        batch = min(samples, MAX_SAMPLES - samples)
+
+
+def equity_progress(hero_combos, villain_combos, board):
+    """
+    hero_combos and villain_combos are ranges on the board(see check_ranges),
+    yields dicts with hero's equity(the share of the pot hero wins on average),
+        each more accurate than the one before:
+        {"equity": .., "samples": .., "exact": False} from monte carlo,
+        {"equity": .., "matchups_done": .., "matchups": .., "exact": False}
+            while enumerating, and finally the same with "exact": True.
+    """
+    board = list(board)
+    hero_combos = sorted(hero_combos)
+    villain_combos = sorted(villain_combos)
+    # preflop is never exact, see above.
+    can_be_exact = len(hero_combos) * len(villain_combos) <= MATCHUP_LIMIT and \
+        len(board) >= 3
+    estimates = _monte_carlo(hero_combos, villain_combos, board)
+    for estimate in estimates:
+        yield estimate
+        if can_be_exact and estimate["samples"] >= SAMPLES_BEFORE_EXACT:
+            break
+    if can_be_exact:
+        # the classes are only worked out once the first estimates are out.
+        classes = matchup_classes(hero_combos, villain_combos, board)
+        can_be_exact = len(classes) * _num_runouts(board) <= EXACT_EVALUATION_LIMIT
+    if not can_be_exact:
+        for estimate in estimates:
+            yield estimate
+        return
+
+    total_weight = sum(weight for hero, villain, weight in classes)
+    weighted = 0.0
+    done_weight = 0
+    results = _get_pool().imap_unordered(
+        _enumerate, [(hero, villain, board, weight) for hero, villain, weight in classes],
+        chunksize=max(len(classes) // (EQUITY_PROCESSES * 8), 1))
+    for done, (equity, weight) in enumerate(results, 1):
+        weighted += equity * weight
+        done_weight += weight
+        if done == len(classes) or done % max(len(classes) // 8, 1) == 0:
+            yield {
+                "equity": weighted / done_weight,
+                "matchups_done": done_weight,
+                "matchups": total_weight,
+                "exact": done == len(classes),
+            }
+
@@ -0,0 +1,120 @@
+"""local hand evaluation
+
+unlike poker.apis.score_hands this never leaves the process,
+so it is cheap enough to be called thousands of times per decision.
+cards are in the same format as FrenchDeck: suit + rank, for example 'hA'.
+"""
+
+import random
+import time
+from collections import Counter
+
+# same order as FrenchDeck.ranks, the weakest first.
+# NOTE: '1' is not a rank, it's kept for the games dealt from the old
+#       56 card deck(FrenchDeck.ranks had a bogus '1'), to score them.
+RANK_VALUES = dict((rank, value) for value, rank in enumerate("123456789TJQKA", 1))
+ACE = RANK_VALUES["A"]
+
+# hand categories, the first element of a score.
+HIGH_CARD = 0
+PAIR = 1
+TWO_PAIR = 2
+THREE_OF_A_KIND = 3
+STRAIGHT = 4
+FLUSH = 5
+FULL_HOUSE = 6
+FOUR_OF_A_KIND = 7
+STRAIGHT_FLUSH = 8
+
+
+def _straight_high(values):
+    """the highest card of the best straight in values(a set), or None."""
+    if ACE in values:
+        # the ace plays low as well: A2345
+        values = values | set([1])
+    for high in sorted(values, reverse=True):
+        if all(high - x in values for x in range(1, 5)):
+            return high
+    return None
+
+
+def score_hand(cards):
+    """
+    returns the score of the best 5 card hand out of 5 ~ 7 cards,
+        as a tuple which compares the way hands do, higher is better.
+    for example: ('hA', 'sA', 'd8', 's8', 'sK') => (TWO_PAIR, 14, 8, 13)
+    """
+    values = sorted((RANK_VALUES[card[1]] for card in cards), reverse=True)
+
+    suit_counts = Counter(card[0] for card in cards)
+    flush_suit, flush_count = suit_counts.most_common(1)[0]
+    if flush_count >= 5:
+        flush_values = sorted(
+            (RANK_VALUES[card[1]] for card in cards if card[0] == flush_suit),
+            reverse=True)
+        high = _straight_high(set(flush_values))
+        if high is not None:
+            return (STRAIGHT_FLUSH, high)
+
+    # (count, value) the biggest group first, e.g. trips before pairs.
+    groups = sorted(((n, v) for v, n in Counter(values).items()), reverse=True)
+    if groups[0][0] == 4:
+        quads = groups[0][1]
+        return (FOUR_OF_A_KIND, quads, max(v for v in values if v != quads))
+    if groups[0][0] == 3 and len(groups) > 1 and groups[1][0] >= 2:
+        # with two trips the lower one can beat the pair as the pair part.
+        return (FULL_HOUSE, groups[0][1], max(v for n, v in groups[1:] if n >= 2))
+    if flush_count >= 5:
+        return (FLUSH,) + tuple(flush_values[:5])
+    high = _straight_high(set(values))
+    if high is not None:
+        return (STRAIGHT, high)
+    if groups[0][0] == 3:
+        trips = groups[0][1]
+        return (THREE_OF_A_KIND, trips) + tuple(v for v in values if v != trips)[:2]
+    if groups[0][0] == 2 and groups[1][0] == 2:
+        high_pair, low_pair = groups[0][1], groups[1][1]
+        kicker = max(v for v in values if v not in (high_pair, low_pair))
+        return (TWO_PAIR, high_pair, low_pair, kicker)
+    if groups[0][0] == 2:
+        pair = groups[0][1]
+        return (PAIR, pair) + tuple(v for v in values if v != pair)[:3]
+    return (HIGH_CARD,) + tuple(values[:5])
+
+
+def estimate_equity(pocket, community, num_opponents, deck,
+                    deadline=None, max_samples=2000):
+    """
+    monte carlo estimate of the share of the pot the pocket cards win
+        against num_opponents random hands, given the community cards so far.
+    deck: every card of the deck, e.g. FrenchDeck.DECK_52.
+    stops at max_samples, or earlier once time.time() passes deadline.
+    returns (equity, number of samples).
+    """
+    known = set(pocket) | set(community)
+    remaining = [card for card in deck if card not in known]
+    board_needed = 5 - len(community)
+    cards_needed = board_needed + 2 * num_opponents
+
+    equity = 0.0
+    samples = 0
+    while samples < max_samples:
+        # checking the clock every few samples is cheaper than every time.
+        if deadline is not None and samples % 16 == 0 and \
+                samples and time.time() > deadline:
+            break
+        drawn = random.sample(remaining, cards_needed)
+        board = list(community) + drawn[:board_needed]
+        my_score = score_hand(list(pocket) + board)
+        tied = 1
+        for x in range(board_needed, cards_needed, 2):
+            their_score = score_hand(drawn[x:x + 2] + board)
+            if their_score > my_score:
+                tied = 0
+                break
+            if their_score == my_score:
+                tied += 1
+        if tied:
+            equity += 1.0 / tied
+        samples += 1
+    return (equity / samples if samples else 0.0), samples
@@ -0,0 +1,106 @@
+"""replays finished games into PlayerStats
+
+meant for the games played before the stats were counted as the games go,
+so it has to be told where those end(--until-game-id), or to rebuild the
+stats from scratch(--reset), anything else would count games twice.
+only games which are over are replayed, running games are counted live.
+NOTE: with --reset the hands running at the time are not counted.
+NOTE: flops, turns and rivers seen are only counted live. a finished
+      game keeps who folded but not on which street, so replaying it
+      can't tell which streets a player who folded saw.
+the games are read in batches of --batch-size, so memory stays flat
+no matter how many games there are.
+"""
+
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from poker.handeval import score_hand
+from poker.models import BettingStatus, Game, GameStages, PlayerStats, Seat
+
+
+def game_counters(player_guids, pocket_cards, community_cards, stage, betting_status):
+    """
+    returns {user_guid: Counter of stats} for a single game:
+        hands played and showdowns seen and won, see the NOTE above.
+    """
+    counters = defaultdict(Counter)
+    if stage == GameStages.Initial:
+        return counters
+    players = player_guids.split("|")
+    # NOTE: games played before folds were kept for the whole hand only
+    #       know the folds of their last betting round.
+    still_in = [x for x in range(0, len(players))
+                if betting_status[x:x + 1] != BettingStatus.Fold]
+    for user_guid in players:
+        counters[user_guid]["hands_played"] += 1
+    if stage == GameStages.GameOver and still_in:
+        community = community_cards.split("|")
+        pockets = pocket_cards.split("$")
+        scores = dict((x, score_hand(pockets[x].split("|") + community)) for x in still_in)
+        best = max(scores.values())
+        for x in still_in:
+            counters[players[x]]["showdowns_seen"] += 1
+            if scores[x] == best:
+                counters[players[x]]["showdowns_won"] += 1
+    return counters
+
+
+class Command(BaseCommand):
+    help = "Replays the games into the player stats counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="number of games read and counted at a time.")
+        parser.add_argument(
+            "--until-game-id", type=int, default=None,
+            help="only games up to this id, e.g. the last game before the counters were live.")
+        parser.add_argument(
+            "--reset", action="store_true", default=False,
+            help="start all counters from zero, rebuilding the stats from every game.")
+
+    def handle(self, *args, **options):
+        if options["until_game_id"] is None and not options["reset"]:
+            raise CommandError(
+                "Games are counted live, give --until-game-id(the last game before "
+                "that) or --reset, otherwise they'd be counted twice.")
+        games = Game.objects.filter(stage=GameStages.GameOver)
+        if options["until_game_id"] is not None:
+            games = games.filter(pk__lte=options["until_game_id"])
+        if options["reset"]:
+            PlayerStats.objects.all().delete()
+
+        last_pk = 0
+        total = 0
+        while True:
+            batch = list(games.filter(pk__gt=last_pk).order_by("pk").values_list(
+                "pk", "player_guids", "pocket_cards", "community_cards",
+                "stage", "betting_status")[:options["batch_size"]])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            self._count_batch(batch)
+            total += len(batch)
+            self.stdout.write("%d games counted" % total)
+
+    def _count_batch(self, batch):
+        counters = defaultdict(Counter)
+        for row in batch:
+            for user_guid, counter in game_counters(*row[1:]).items():
+                counters[user_guid].update(counter)
+        # VPIP is only known for games played with chips.
+        for user_guid in Seat.objects.filter(
+                game_id__in=[row[0] for row in batch],
+                voluntarily_played=True).values_list("user_guid", flat=True):
+            counters[user_guid]["vpip_hands"] += 1
+
+        # players with the same increments are updated together.
+        players_by_increments = defaultdict(list)
+        for user_guid, counter in counters.items():
+            players_by_increments[tuple(sorted(counter.items()))].append(user_guid)
+        with transaction.atomic():
+            for increments, user_guids in players_by_increments.items():
+                PlayerStats.increment(user_guids, **dict(increments))
@@ -0,0 +1,73 @@
+"""benchmarks the ways a client can poll game_status
+
+    full: no since_version, the whole status is built and sent every time,
+        which is what clients did before versions.
+    delta: since_version of an older version, only the changes are sent.
+    unchanged: since_version of the current version, the cheap path
+        most waiting clients take.
+runs against a test database(as manage.py test would), created for the run
+and destroyed after it, the real one is never touched.
+"""
+
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from poker import views
+from poker.models import Game
+from poker.querybudget import counted_queries
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the game_status polling paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            self._bench_polls(options["requests"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _bench_polls(self, num_of_requests):
+        game = Game(total_num_of_players=2, player_guids="bench-1|bench-2",
+                    player_to_action="bench-1")
+        game.save()
+        game = game.move_to_next_stage_if_ready()
+        # an older version to send deltas against.
+        old_status = self._poll(game.guid)
+        game.record_action("bench-1", "C")
+        current = self._poll(game.guid)
+
+        factory = RequestFactory()
+        for name, since_version in (
+                ("full", None),
+                ("delta", old_status["version"]),
+                ("unchanged", current["version"])):
+            params = {"user_guid": "bench-1", "game_guid": game.guid}
+            if since_version is not None:
+                params["since_version"] = since_version
+            self._bench(name, num_of_requests,
+                        lambda: views.game_status(factory.get("/game/status/", params)))
+
+    def _poll(self, game_guid):
+        params = {"user_guid": "bench-1", "game_guid": game_guid}
+        return json.loads(views.game_status(
+            RequestFactory().get("/game/status/", params)).content)
+
+    def _bench(self, name, num_of_requests, request):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            for x in range(0, num_of_requests):
+                response = request()
+            elapsed = time.time() - start
+        self.stdout.write("%-10s %8.3f ms/request %6.1f queries/request %6d bytes" % (
+            name, 1000 * elapsed / num_of_requests,
+            float(len(counted_queries(queries.captured_queries))) / num_of_requests, len(response.content)))
@@ -0,0 +1,48 @@
+"""dumps the state of the active games for a warm restart
+
+run it right before restarting, the restarted processes memory-map the
+snapshot at startup(see poker.apps) and serve the seats of the games in it
+without reading them from the database, as long as the games haven't
+changed since. the game rows are still read, see poker.snapshot.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from poker import snapshot
+from poker.models import Game, GameStages, Seat
+
+# games read per query.
+BATCH_SIZE = 500
+
+
+def active_games_with_seats():
+    """yields (game, seat rows) of every game not over yet, by primary key."""
+    last_pk = 0
+    while True:
+        games = list(Game.objects.exclude(stage=GameStages.GameOver).filter(
+            pk__gt=last_pk).order_by("pk")[:BATCH_SIZE])
+        if not games:
+            return
+        seats = dict((game.pk, []) for game in games)
+        for row in Seat.objects.filter(game__in=games).order_by("game", "position").values_list(
+                "game_id", *snapshot.SEAT_FIELDS):
+            seats[row[0]].append(row[1:])
+        for game in games:
+            yield game, seats[game.pk]
+        last_pk = games[-1].pk
+
+
+class Command(BaseCommand):
+    help = "Dumps the state of the active games into a snapshot loaded at startup."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path", default=getattr(settings, "GAME_SNAPSHOT_PATH", None),
+            help="where to write the snapshot, GAME_SNAPSHOT_PATH by default.")
+
+    def handle(self, *args, **options):
+        if not options["path"]:
+            raise CommandError("No GAME_SNAPSHOT_PATH set, give a --path.")
+        count = snapshot.dump(options["path"], active_games_with_seats())
+        self.stdout.write("Dumped %d games to %s" % (count, options["path"]))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-19 08:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0003_game_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Seat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_guid', models.CharField(max_length=36)),
+                ('position', models.IntegerField(help_text=b'index of the player in game.player_guids.')),
+                ('chips', models.IntegerField(default=1000, help_text=b'chips in front of the player, not bet yet.')),
+                ('round_bet', models.IntegerField(default=0, help_text=b'chips the player has bet in the current betting round.')),
+                ('hand_bet', models.IntegerField(default=0, help_text=b'chips the player has put into the pot during the whole hand, which decides the side pots he is eligible for.')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seats', to='poker.Game')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='seat',
+            unique_together=set([('game', 'position')]),
+        ),
+    ]
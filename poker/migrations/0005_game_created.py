@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-19 08:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0004_seat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text=b'when the game was created, bots join games waiting too long for players.'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-19 08:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0005_game_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tournament',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guid', models.CharField(blank=True, default=uuid.uuid4, help_text=b'Unique, externally-friendly identifier for a specific tournament', max_length=36, unique=True)),
+                ('table_size', models.IntegerField(default=3, help_text=b'maximum number of players at a table, 3 at most for now(see Game.player_guids).')),
+                ('level', models.IntegerField(default=0, help_text=b'the current blind level, index into poker.tournament.BLIND_LEVELS.')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TournamentEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_guid', models.CharField(max_length=36)),
+                ('chips', models.IntegerField(default=1000, help_text=b'chips at the start of the current hand.')),
+                ('eliminated', models.BooleanField(default=False)),
+                ('game', models.ForeignKey(blank=True, help_text=b'the table the player sits at, none until seated or once eliminated.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tournament_entries', to='poker.Game')),
+                ('tournament', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='poker.Tournament')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='tournament',
+            field=models.ForeignKey(blank=True, help_text=b'the tournament this game is a table of, if any.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tables', to='poker.Tournament'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tournamententry',
+            unique_together=set([('tournament', 'user_guid')]),
+        ),
+    ]
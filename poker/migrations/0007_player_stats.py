@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-19 08:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0006_tournament'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_guid', models.CharField(max_length=36, unique=True)),
+                ('hands_played', models.IntegerField(db_index=True, default=0)),
+                ('vpip_hands', models.IntegerField(default=0, help_text=b'hands the player voluntarily put chips in preflop.')),
+                ('flops_seen', models.IntegerField(default=0)),
+                ('turns_seen', models.IntegerField(default=0)),
+                ('rivers_seen', models.IntegerField(default=0)),
+                ('showdowns_seen', models.IntegerField(default=0)),
+                ('showdowns_won', models.IntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='seat',
+            name='voluntarily_played',
+            field=models.BooleanField(default=False, help_text=b'the player put chips in preflop without being forced to(VPIP).'),
+        ),
+    ]
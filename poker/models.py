@@ -1,7 +1,15 @@
 import uuid
 import random
-from django.db import models
-from poker.apis import score_hands
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+from poker.handeval import score_hand
+from poker.pots import calculate_pots, distribute_pots
+
+# chips every player sits down with.
+STARTING_CHIPS = 1000
+# an Initial game waits for this many players before dealing.
+MIN_PLAYERS_TO_START = 2
 
 class FrenchDeck:
     """
@@ -23,7 +31,7 @@ class FrenchDeck:
     # K - King
     # A - Ace
     suits = ['d', 'c', 'h', 's']
-    ranks = ['1', '2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
+    ranks = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
     DECK_52 = [x+y for x in suits for y in ranks]
 #     DECK_52 = [
 #         "d2", "d3", "d4", "d5", "d6", "d7", "d8", "d9", "dT", "dJ", "dQ", "dK", "dA",
@@ -78,6 +86,14 @@ class BettingStatus:
     Reraise = "R"
     NotDone = "N" # not done betting
 
+class NotEnoughChips(Exception):
+    """a player tried to bet more chips than he has."""
+    pass
+
+class BetTooSmall(Exception):
+    """a player tried to bet less than it takes to call."""
+    pass
+
 class GameStages:
     """stages of a game"""
     Initial = "I" # no card has been dealt yet.
@@ -167,20 +183,96 @@ class Game(models.Model):
         help_text=("place holder once we feel comfortable with introducing bets and betting history.")
     )
 
+    version = models.IntegerField(
+        default=0,
+        help_text=(
+            "Incremented every time the game is saved. "
+            "Clients send back the last version they have seen "
+            "so only what changed since then needs to be sent to them."
+        ),
+    )
+
+    created = models.DateTimeField(
+        default=timezone.now,
+        help_text="when the game was created, bots join games waiting too long for players."
+    )
+
+    tournament = models.ForeignKey(
+        "Tournament", null=True, blank=True, related_name="tables",
+        on_delete=models.CASCADE,
+        help_text="the tournament this game is a table of, if any."
+    )
+
+    def save(self, *args, **kwargs):
+        """every save produces a new version of the game."""
+        self.version += 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "version" not in update_fields:
+            kwargs["update_fields"] = list(update_fields) + ["version"]
+        super(Game, self).save(*args, **kwargs)
+
     def _get_next_user_guid(self, current_user_guid):
-        """get the user guid to the right of current player"""
+        """get the user guid to the right of current player, skipping those who folded"""
         index = self._get_player_index(current_user_guid)
         user_guid_list = self.player_guids.split("|")
+        for x in range(1, len(user_guid_list)):
+            position = (index + x) % len(user_guid_list)
+            if self.betting_status[position:position + 1] != BettingStatus.Fold:
+                return user_guid_list[position]
         return user_guid_list[(index+1)%len(user_guid_list)]
 
-    def record_action(self, user_guid, action_type):
+    def record_action(self, user_guid, action_type, amount=0):
         """
         record the user action, and update the status of the game
         if applicable, push the game into next stage.
+        amount is the number of chips put in by a bet or re-raise,
+            a call puts in whatever is needed to match the highest bet,
+            or all of the player's chips if he has less than that.
+        raises NotEnoughChips if a bet is bigger than the player's stack,
+            BetTooSmall if it's less than what it takes to call(or nothing).
+        a bet bigger than that re-opens the betting round, everybody
+            still in has to act again.
+        NOTE: the caller holds the game's row lock(select_for_update) for
+            the whole transaction, every action of a game runs under it,
+            which is what makes reading the round bets for a call safe.
         """
-        # update betting status
         user_index = self._get_player_index(user_guid)
+        with transaction.atomic():
+            chips_moved, raised = self._move_chips_for_action(user_index, action_type, amount)
+            # the first chips a player puts in preflop count for VPIP,
+            # once per hand.
+            if chips_moved and self.stage == GameStages.PocketDone and \
+                    self.seats.filter(position=user_index, voluntarily_played=False).update(
+                        voluntarily_played=True):
+                PlayerStats.increment([user_guid], vpip_hands=1)
+            self._record_betting_status(user_guid, user_index, action_type, raised)
+
+    def _move_chips_for_action(self, user_index, action_type, amount):
+        """returns (True if any chips moved, True if the bet was raised)."""
+        seat = self.seats.filter(position=user_index)
+        if action_type not in (
+                BettingStatus.Call_Or_Check, BettingStatus.Bet, BettingStatus.Reraise):
+            return False, False
+        round_bets = dict(self.seats.values_list("position", "round_bet"))
+        to_call = max(round_bets.values() or [0]) - round_bets.get(user_index, 0)
+        if action_type == BettingStatus.Call_Or_Check:
+            if to_call > 0 and not Seat.bet(seat, to_call):
+                Seat.all_in(seat)
+            return to_call > 0, False
+        if amount <= 0 or amount < to_call:
+            raise BetTooSmall
+        if not Seat.bet(seat, amount):
+            raise NotEnoughChips
+        return True, amount > to_call
+
+    def _record_betting_status(self, user_guid, user_index, action_type, raised=False):
+        # update betting status
         user_action_list = list(self.betting_status)
+        if raised:
+            # everybody else still in has to act on the raise.
+            user_action_list = [
+                x if x == BettingStatus.Fold else BettingStatus.NotDone
+                for x in user_action_list]
         user_action_list[user_index] = action_type
         self.betting_status = "".join(user_action_list)
 
@@ -194,6 +286,10 @@ class Game(models.Model):
         NOTE: this method need to remain very efficient
             as it is supposed to be called very frequently.
         """
+        if self.stage == GameStages.Initial:
+            return self.total_num_of_players >= MIN_PLAYERS_TO_START
+        if self.stage == GameStages.GameOver:
+            return False
         return "N" not in self.betting_status and \
                 self.total_num_of_players > 0
 
@@ -201,7 +297,7 @@ class Game(models.Model):
         # TODO: test this.
         pocket_card_list = self.pocket_cards.replace("$", "|").split("|")
         community_card_list = self.community_cards.split("|")
-        return pocket_card_list.extend(community_card_list)
+        return [x for x in pocket_card_list + community_card_list if x]
 
     def _get_user_guid(self, index):
         player_guid_list = self.player_guids.split("|")
@@ -212,45 +308,36 @@ class Game(models.Model):
             raise Exception
         return self.player_guids.split("|").index(user_guid)
 
-    def move_to_next_stage_if_ready(self):
+    def move_to_next_stage_if_ready(self, commit=True):
         """
         game engine would push the game into next stage
         whether this means a round of dealing cards,
             or showdown, or whatever # TODO: supported in v2.
+        with commit=False neither the game nor its seats are saved,
+            for callers saving many games at once.
+        tournament tables only start new hands with commit=False,
+            see poker.tournament.deal_next_stage.
         returns the updated game.
         """
         if not self._is_next_stage_ready():
             return self
+        if commit and self.stage == GameStages.Initial and self.tournament_id is not None:
+            # the seats of a tournament hand start with the players' chips
+            # left in the tournament and the blinds, which only the
+            # tournament deals.
+            return self
 
         # corresponding action would be taken and
         # game would be updated
         if self.stage == GameStages.RiverDone:
             # River card has been served and the betting round is done.
             # time for scoring!
-            hands_info = {}
-            hands_info["players"] = []
-            for x in range(0, self.total_num_of_players):
-                player = {}
-                user_guid = self._get_user_guid(x)
-                player["name"] = user_guid
-                p_str = self.get_user_pocket_cards(user_guid) # h3|h4
-                card_1 = {"suit": p_str[0], "name": p_str[1]}
-                card_2 = {"suit": p_str[3], "name": p_str[4]}
-                pocket = []
-                pocket.append(card_1)
-                pocket.append(card_2)
-                player["pocket"] = pocket
-                hands_info["players"].append(player)
-            hands_info["community"] = []
-            c_cards = self.community_cards.split("|")
-            for x in range(0, 5):
-                card = c_cards[x]
-                c_card = {"suit": card[0], "name": card[1]}
-                hands_info["community"].append(c_card)
-            score_result = score_hands(hands_info)
-            # TODO: update winning info.
+            if commit:
+                self._showdown()
             return self
 
+        new_hand = self.stage == GameStages.Initial
+        still_in = [self._get_user_guid(x) for x in self._positions_still_in()]
         if self.stage == GameStages.Initial:
             # serve pocket cards
             num_of_cards = self.total_num_of_players * 2
@@ -277,12 +364,85 @@ class Game(models.Model):
                 number_of_cards=1, exclude_cards=self._get_served_card_list())
             self.community_cards += "|" + "|".join(river_card) # 'sA|s7|h5|hK|dK'
             self.stage = GameStages.RiverDone
-        # TODO: consider folded users in v2
-        self.player_to_action = self._get_user_guid(0)
-        self.betting_status = "N" * self.total_num_of_players
+        if new_hand:
+            self.betting_status = BettingStatus.NotDone * self.total_num_of_players
+        else:
+            # a fold is for the whole hand, not just the betting round.
+            self.betting_status = "".join(
+                BettingStatus.Fold if x == BettingStatus.Fold else BettingStatus.NotDone
+                for x in self.betting_status)
+        self.player_to_action = self._get_user_guid((self._positions_still_in() or [0])[0])
+        if not commit:
+            return self
         self.save() # NOTE: this would trigger updates actively to subscribers through websocket
+        if new_hand:
+            Seat.objects.bulk_create([
+                Seat(game=self, user_guid=self._get_user_guid(x), position=x)
+                for x in range(0, self.total_num_of_players)
+            ])
+            PlayerStats.increment(still_in, hands_played=1)
+        else:
+            # a new betting round.
+            self.seats.update(round_bet=0)
+            PlayerStats.increment(still_in, **{PlayerStats.STAGE_REACHED[self.stage]: 1})
         return self
 
+    def _showdown(self):
+        """
+        scores the hands still in, hands the pots over and ends the game.
+        NOTE: scored in process, see poker.handeval.
+        """
+        scores = self.showdown_scores()
+        with transaction.atomic():
+            self.stage = GameStages.GameOver
+            self.player_to_action = ""
+            self.save()
+            self.award_pots(scores)
+            PlayerStats.increment(
+                [self._get_user_guid(x) for x in scores], showdowns_seen=1)
+            PlayerStats.increment(
+                [self._get_user_guid(x) for x in showdown_winners(scores)], showdowns_won=1)
+
+    def showdown_scores(self):
+        """{position: hand score} of the players still in, higher is better."""
+        community = self.community_cards.split("|")
+        scores = {}
+        for x in self._positions_still_in():
+            pocket = self.get_user_pocket_cards(self._get_user_guid(x)).split("|")
+            scores[x] = score_hand(pocket + community)
+        return scores
+
+    def _positions_still_in(self):
+        """positions of the players who haven't folded during the hand."""
+        return [x for x in range(0, self.total_num_of_players)
+                if self.betting_status[x:x + 1] != BettingStatus.Fold]
+
+    def get_pots(self):
+        """the main pot and side pots of the current hand, see calculate_pots."""
+        seats = self.seats.order_by("position").values_list("hand_bet", flat=True)
+        folded = [x for x, status in enumerate(self.betting_status)
+                  if status == BettingStatus.Fold]
+        return calculate_pots(list(seats), folded)
+
+    def award_pots(self, scores):
+        """
+        hands the pots over to the winners, scores is {position: hand score}
+            for the players in the showdown, higher is better.
+        all chips in the pots move back into the stacks with a single UPDATE,
+            so no chip is ever created or destroyed.
+        returns {position: chips won}.
+        """
+        with transaction.atomic():
+            winnings = distribute_pots(self.get_pots(), scores)
+            won = models.Case(
+                *[models.When(position=position, then=models.Value(chips))
+                  for position, chips in winnings.items()],
+                default=models.Value(0),
+                output_field=models.IntegerField()
+            )
+            self.seats.update(chips=F("chips") + won, round_bet=0, hand_bet=0)
+        return winnings
+
     def number_of_cards_needed(self):
         """number of cards needed for the game to move into NEXT stage."""
         if self.stage == GameStages.Initial:
@@ -316,6 +476,170 @@ class Game(models.Model):
         pocket_cards_list = self.pocket_cards.split("$")
         return pocket_cards_list[index]
 
+def showdown_winners(scores):
+    """
+    positions winning the showdown, those with the best hand(ties included)
+        whatever is in the pots, the same as
+        poker.management.commands.backfill_player_stats counts them.
+    """
+    best = max(scores.values()) if scores else None
+    return [x for x, score in scores.items() if score == best]
+
+class Seat(models.Model):
+    """
+    A player's chips at a game.
+    NOTE: chips only ever move with conditional UPDATEs(see bet/all_in),
+        never by reading, changing and saving a Seat, so concurrent
+        actions can neither lose nor create chips.
+    """
+    game = models.ForeignKey(Game, related_name="seats", on_delete=models.CASCADE)
+    user_guid = models.CharField(max_length=36)
+    position = models.IntegerField(help_text="index of the player in game.player_guids.")
+    chips = models.IntegerField(
+        default=STARTING_CHIPS,
+        help_text="chips in front of the player, not bet yet."
+    )
+    round_bet = models.IntegerField(
+        default=0,
+        help_text="chips the player has bet in the current betting round."
+    )
+    hand_bet = models.IntegerField(
+        default=0,
+        help_text=(
+            "chips the player has put into the pot during the whole hand, "
+            "which decides the side pots he is eligible for."
+        ),
+    )
+    voluntarily_played = models.BooleanField(
+        default=False,
+        help_text="the player put chips in preflop without being forced to(VPIP)."
+    )
+
+    class Meta:
+        unique_together = ("game", "position")
+
+    @staticmethod
+    def bet(seats, amount):
+        """
+        moves amount chips from the stack of the given seat(a queryset)
+            into the pot, provided the stack is big enough.
+        returns False if it's not.
+        """
+        return seats.filter(chips__gte=amount).update(
+            chips=F("chips") - amount,
+            round_bet=F("round_bet") + amount,
+            hand_bet=F("hand_bet") + amount,
+        ) > 0
+
+    @staticmethod
+    def all_in(seats):
+        """moves the whole stack of the given seat(a queryset) into the pot."""
+        # two statements since not every database evaluates all the SET
+        # expressions against the row as it was before the UPDATE.
+        seats.update(
+            round_bet=F("round_bet") + F("chips"),
+            hand_bet=F("hand_bet") + F("chips"),
+        )
+        seats.update(chips=0)
+
+class Tournament(models.Model):
+    """
+    A multi-table tournament, its tables are Games.
+    """
+    guid = models.CharField(
+        max_length=36, blank=True, unique=True, default=uuid.uuid4,
+        help_text=(
+            "Unique, externally-friendly identifier for a specific tournament"
+        ),
+    )
+    table_size = models.IntegerField(
+        default=3,
+        help_text="maximum number of players at a table, 3 at most for now(see Game.player_guids)."
+    )
+    level = models.IntegerField(
+        default=0,
+        help_text="the current blind level, index into poker.tournament.BLIND_LEVELS."
+    )
+    created = models.DateTimeField(default=timezone.now)
+
+class TournamentEntry(models.Model):
+    """
+    A player in a tournament, and the table he sits at.
+    """
+    tournament = models.ForeignKey(Tournament, related_name="entries", on_delete=models.CASCADE)
+    user_guid = models.CharField(max_length=36)
+    game = models.ForeignKey(
+        Game, null=True, blank=True, related_name="tournament_entries",
+        on_delete=models.SET_NULL,
+        help_text="the table the player sits at, none until seated or once eliminated."
+    )
+    chips = models.IntegerField(default=STARTING_CHIPS, help_text="chips at the start of the current hand.")
+    eliminated = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ("tournament", "user_guid")
+
+class PlayerStats(models.Model):
+    """
+    Running totals of a player's games, kept up to date as the games go
+        (see PlayerStats.increment) so neither stats nor leaderboards
+        ever need to replay old games.
+    """
+    # counter of the players still in when the game reaches a stage.
+    STAGE_REACHED = {
+        GameStages.FLopDone: "flops_seen",
+        GameStages.TurnDone: "turns_seen",
+        GameStages.RiverDone: "rivers_seen",
+    }
+
+    user_guid = models.CharField(max_length=36, unique=True)
+    hands_played = models.IntegerField(default=0, db_index=True)
+    vpip_hands = models.IntegerField(
+        default=0, help_text="hands the player voluntarily put chips in preflop."
+    )
+    flops_seen = models.IntegerField(default=0)
+    turns_seen = models.IntegerField(default=0)
+    rivers_seen = models.IntegerField(default=0)
+    showdowns_seen = models.IntegerField(default=0)
+    # showdowns the player had the best hand at, split pots included.
+    showdowns_won = models.IntegerField(default=0, db_index=True)
+
+    @classmethod
+    def increment(cls, user_guids, **counters):
+        """
+        adds counters(counter=amount) to the stats of the given players,
+            with a single UPDATE unless some players have no stats yet.
+        """
+        user_guids = set(user_guids)
+        if not user_guids:
+            return
+        increments = dict((name, F(name) + amount) for name, amount in counters.items())
+        updated = cls.objects.filter(user_guid__in=user_guids).update(**increments)
+        if updated == len(user_guids):
+            return
+        missing = user_guids - set(cls.objects.filter(
+            user_guid__in=user_guids).values_list("user_guid", flat=True))
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create([cls(user_guid=x, **counters) for x in missing])
+        except IntegrityError:
+            # some were created by somebody else in the meantime.
+            cls.increment(missing, **counters)
+
+    def as_dict(self):
+        return {
+            "user_guid": self.user_guid,
+            "hands_played": self.hands_played,
+            "vpip": float(self.vpip_hands) / self.hands_played if self.hands_played else 0.0,
+            "flops_seen": self.flops_seen,
+            "turns_seen": self.turns_seen,
+            "rivers_seen": self.rivers_seen,
+            "showdowns_seen": self.showdowns_seen,
+            "showdowns_won": self.showdowns_won,
+            "showdown_win_rate": float(self.showdowns_won) / self.showdowns_seen
+                if self.showdowns_seen else 0.0,
+        }
+
 class User(models.Model):
     """
     # Records the meta data for a user(name, chips etc) and the current game the user is in, if any.
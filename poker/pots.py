@@ -0,0 +1,91 @@
+"""pot and side pot calculation
+
+everything works on plain lists indexed by player position
+(the same order as Game.player_guids), so it can be used without
+touching the database.
+"""
+
+
+def calculate_pots(contributions, folded=()):
+    """
+    splits the chips put in during a hand into the main pot and side pots.
+    contributions: chips each player has put in during the hand, by position.
+    folded: positions of the players who folded, their chips still count
+        but they can not win any pot.
+    returns a list of (amount, [eligible positions]), main pot first.
+    every chip put in ends up in a pot somebody can win: chips of folded
+        players nobody still in has matched go to the players still in,
+        and if everybody folded each player's chips are a pot of his own.
+
+    for example: A all-in for 50, B and C call 100, D folded after 30:
+        calculate_pots([50, 100, 100, 30], folded=[3])
+        => [(180, [0, 1, 2]), (100, [1, 2])]
+
+    NOTE: the contributions are sorted once and swept once to add up
+        the pots, but listing the eligible players of each pot makes it
+        O(players x levels) overall, which is 10 x 10 at most at a table.
+    """
+    folded = set(folded)
+    order = sorted(range(len(contributions)), key=lambda p: contributions[p])
+    live_levels = sorted(set(
+        contributions[p] for p in order if p not in folded and contributions[p] > 0))
+
+    pots = []
+    previous_level = 0
+    i = 0
+    for level in live_levels:
+        amount = 0
+        # players who put in less than this level have all
+        # their remaining chips in this pot...
+        while i < len(order) and contributions[order[i]] < level:
+            amount += contributions[order[i]] - previous_level
+            i += 1
+        eligible_from = i
+        # ...everybody else matches this level.
+        while i < len(order) and contributions[order[i]] == level:
+            i += 1
+        amount += (len(order) - eligible_from) * (level - previous_level)
+        eligible = sorted(p for p in order[eligible_from:] if p not in folded)
+        pots.append((amount, eligible))
+        previous_level = level
+
+    # chips of folded players above the highest live level are dead money
+    # and go to the last pot.
+    dead = sum(contributions[p] - previous_level for p in order[i:])
+    if dead:
+        still_in = sorted(p for p in order if p not in folded)
+        if pots:
+            last_amount, last_eligible = pots[-1]
+            pots[-1] = (last_amount + dead, last_eligible)
+        elif still_in:
+            # nobody still in put any chips in.
+            pots.append((dead, still_in))
+        else:
+            pots.extend((contributions[p], [p]) for p in sorted(order) if contributions[p] > 0)
+    return pots
+
+
+def distribute_pots(pots, scores):
+    """
+    decides who wins what.
+    pots: as returned by calculate_pots.
+    scores: {position: hand score}, higher is better.
+    returns {position: chips won}.
+    a tie splits the pot, the odd chips go to the tied players
+    in order of position.
+    a pot none of whose eligible players has a score(e.g. everybody folded)
+    is split between the eligible players, it's never left without a winner.
+    """
+    winnings = {}
+    for amount, eligible in pots:
+        contenders = [p for p in eligible if p in scores]
+        if contenders:
+            best = max(scores[p] for p in contenders)
+            winners = sorted(p for p in contenders if scores[p] == best)
+        else:
+            winners = sorted(eligible)
+        share, odd_chips = divmod(amount, len(winners))
+        for index, position in enumerate(winners):
+            winnings[position] = winnings.get(position, 0) + share + \
+                (1 if index < odd_chips else 0)
+    return winnings
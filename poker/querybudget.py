@@ -0,0 +1,135 @@
+"""per view database query budgets
+
+every view declares the maximum number of queries it is allowed to run:
+
+    @query_budget(2)
+    def game_status(request):
+        ...
+
+when QUERY_BUDGET_ENABLED is on(it is by default in DEBUG) the queries
+of each request are counted, reported back in the X-Query-Count header
+and checked against the budget. the same SQL repeated with different
+parameters more than N_PLUS_ONE_THRESHOLD times is reported as a likely
+N+1 query, for example: fetching a Game per player in a loop.
+going over budget is logged, or raised as QueryBudgetExceeded
+when QUERY_BUDGET_STRICT is on, which is what tests should use
+(see QueryBudgetTestMixin).
+work which only happens to run in the view's thread, e.g. an on_commit
+callback acting for a bot, is kept out of the count with uncounted().
+"""
+
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+# the same statement this many times in one request smells like N+1.
+N_PLUS_ONE_THRESHOLD = 3
+
+# transaction control(BEGIN, savepoints...) is bookkeeping whose number
+# depends on the database backend and on how deeply the view is nested
+# in atomic blocks(tests wrap everything in one),
+# so it is not counted against the budget.
+_TRANSACTION_SQL = re.compile(
+    r"^\s*(BEGIN|COMMIT|ROLLBACK|(RELEASE |ROLLBACK TO )?SAVEPOINT)\b", re.IGNORECASE)
+# literals are replaced so the same statement with different
+# parameters is recognized as a repetition.
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+# .uncounted: the queries run within uncounted() during the current
+# budgeted view, None outside of one.
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    """a view ran more queries than it declared, or ran N+1 queries."""
+    pass
+
+
+def counted_queries(captured_queries):
+    """the SQL of the captured queries which count against a budget."""
+    return [q["sql"] for q in captured_queries if not _TRANSACTION_SQL.match(q["sql"])]
+
+
+def repeated_queries(sql_list):
+    """
+    returns {normalized sql: times} for the statements repeated
+        more than N_PLUS_ONE_THRESHOLD times in sql_list.
+    """
+    counts = Counter(_SQL_LITERALS.sub("?", sql) for sql in sql_list)
+    return dict((sql, n) for sql, n in counts.items() if n > N_PLUS_ONE_THRESHOLD)
+
+
+@contextmanager
+def uncounted():
+    """the queries run within don't count against the budget of the current view."""
+    with CaptureQueriesContext(connection) as context:
+        yield
+    if getattr(_local, "uncounted", None) is not None:
+        _local.uncounted.extend(context.captured_queries)
+
+
+def _report(message):
+    if getattr(settings, "QUERY_BUDGET_STRICT", False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def query_budget(max_queries):
+    """
+    decorator declaring the maximum number of queries a view may run.
+    the budget is kept on the view as `view.query_budget`.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(settings, "QUERY_BUDGET_ENABLED", settings.DEBUG):
+                return view(request, *args, **kwargs)
+            _local.uncounted = []
+            try:
+                with CaptureQueriesContext(connection) as context:
+                    response = view(request, *args, **kwargs)
+                skipped = set(id(q) for q in _local.uncounted)
+            finally:
+                _local.uncounted = None
+            sql_list = counted_queries(
+                [q for q in context.captured_queries if id(q) not in skipped])
+            response[QUERY_COUNT_HEADER] = str(len(sql_list))
+            if len(sql_list) > max_queries:
+                _report("%s ran %d queries, over its budget of %d:\n%s" % (
+                    view.__name__, len(sql_list), max_queries, "\n".join(sql_list)))
+            for sql, times in repeated_queries(sql_list).items():
+                _report("%s ran the same query %d times(N+1?): %s" % (
+                    view.__name__, times, sql))
+            return response
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+
+class QueryBudgetTestMixin(object):
+    """
+    mixin for django TestCase: every view requested through self.client
+        during the test must stay within its query budget,
+        otherwise the request raises QueryBudgetExceeded and the test fails.
+    """
+
+    def setUp(self):
+        super(QueryBudgetTestMixin, self).setUp()
+        strict_budgets = override_settings(
+            QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_STRICT=True)
+        strict_budgets.enable()
+        self.addCleanup(strict_budgets.disable)
+
+    def assertNumQueriesReported(self, response, num):
+        """assert the exact number of queries the view reported."""
+        self.assertEqual(int(response[QUERY_COUNT_HEADER]), num)
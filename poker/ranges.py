@@ -0,0 +1,147 @@
+"""hand range notation
+
+parses the usual shorthand for sets of pocket cards into combos,
+a combo being a sorted tuple of two cards of DECK, e.g. ('hA', 'hK').
+a range is a comma separated list of:
+    QQ      a pair
+    QQ+     the pair and every better one
+    QQ-99   the pairs in between
+    AKs     suited, AKo offsuit, AK both
+    ATs+    the kicker going up to one below the top card: ATs, AJs, AQs, AKs
+    KTo-K7o the kickers in between
+    AhKh    a single combo, rank then suit
+    any pair, any(or random, any two)
+for example: "QQ+, AKs" or "any pair".
+"""
+
+import itertools
+import re
+
+from poker.models import FrenchDeck
+
+RANKS = FrenchDeck.ranks
+SUITS = FrenchDeck.suits
+DECK = FrenchDeck.DECK_52
+_RANK = "[%s]" % "".join(RANKS)
+_HAND = re.compile(r"^(%s)(%s)([SO]?)$" % (_RANK, _RANK))
+_COMBO = re.compile(r"^(%s)([%s])(%s)([%s])$" % (_RANK, "".join(SUITS), _RANK, "".join(SUITS)))
+
+
+class RangeError(ValueError):
+    """the range can't be parsed."""
+    pass
+
+
+def _combo(card_1, card_2):
+    return tuple(sorted((card_1, card_2)))
+
+
+def all_combos():
+    return set(_combo(*cards) for cards in itertools.combinations(DECK, 2))
+
+
+def _pair_combos(rank):
+    return set(_combo(suit_1 + rank, suit_2 + rank)
+               for suit_1, suit_2 in itertools.combinations(SUITS, 2))
+
+
+def _two_rank_combos(high, low, suitedness):
+    combos = set()
+    for suit_1 in SUITS:
+        for suit_2 in SUITS:
+            if suitedness == "S" and suit_1 != suit_2:
+                continue
+            if suitedness == "O" and suit_1 == suit_2:
+                continue
+            combos.add(_combo(suit_1 + high, suit_2 + low))
+    return combos
+
+
+def _parse_hand(token):
+    """returns (high rank index, low rank index, suitedness) of e.g. 'AKs'."""
+    match = _HAND.match(token.upper())
+    if not match:
+        raise RangeError("Invalid hand: %s" % token)
+    high, low, suitedness = match.groups()
+    high, low = sorted((RANKS.index(high), RANKS.index(low)), reverse=True)
+    if high == low and suitedness:
+        raise RangeError("A pair can't be suited or offsuit: %s" % token)
+    return high, low, suitedness
+
+
+def _hand_combos(high, low, suitedness):
+    if high == low:
+        return _pair_combos(RANKS[high])
+    return _two_rank_combos(RANKS[high], RANKS[low], suitedness)
+
+
+def _parse_token(token):
+    keyword = " ".join(token.lower().split())
+    if keyword in ("any", "random", "any two"):
+        return all_combos()
+    if keyword in ("any pair", "pairs"):
+        return set().union(*[_pair_combos(rank) for rank in RANKS])
+
+    match = _COMBO.match(token[0:1].upper() + token[1:2].lower() +
+                         token[2:3].upper() + token[3:].lower())
+    if match:
+        rank_1, suit_1, rank_2, suit_2 = match.groups()
+        if (rank_1, suit_1) == (rank_2, suit_2):
+            raise RangeError("A combo can't have the same card twice: %s" % token)
+        return set([_combo(suit_1 + rank_1, suit_2 + rank_2)])
+
+    if token.endswith("+"):
+        high, low, suitedness = _parse_hand(token[:-1])
+        if high == low:
+            return set().union(*[_pair_combos(RANKS[x]) for x in range(high, len(RANKS))])
+        return set().union(*[_two_rank_combos(RANKS[high], RANKS[x], suitedness)
+                             for x in range(low, high)])
+
+    if "-" in token:
+        first, last = [_parse_hand(x.strip()) for x in token.split("-", 1)]
+        if first[2] != last[2] or (first[0] == first[1]) != (last[0] == last[1]) or \
+                (first[0] != first[1] and first[0] != last[0]):
+            raise RangeError("Invalid span: %s" % token)
+        if first[0] == first[1]:
+            bottom, top = sorted((first[0], last[0]))
+            return set().union(*[_pair_combos(RANKS[x]) for x in range(bottom, top + 1)])
+        bottom, top = sorted((first[1], last[1]))
+        return set().union(*[_two_rank_combos(RANKS[first[0]], RANKS[x], first[2])
+                             for x in range(bottom, top + 1)])
+
+    return _hand_combos(*_parse_hand(token))
+
+
+def parse_range(text, dead_cards=()):
+    """
+    returns the set of combos in the range text,
+        leaving out those holding any of the dead cards(e.g. the board).
+    raises RangeError if the text can't be parsed.
+    """
+    combos = set()
+    for token in text.split(","):
+        token = token.strip()
+        if token:
+            combos |= _parse_token(token)
+    if not combos:
+        raise RangeError("Empty range.")
+    dead_cards = set(dead_cards)
+    return set(combo for combo in combos if not dead_cards.intersection(combo))
+
+
+def parse_board(text):
+    """
+    returns the list of board cards in text, e.g. 'hQ|d7|c2'.
+    raises RangeError unless it's 0, 3, 4 or 5 different cards of DECK.
+    """
+    cards = []
+    for token in [x.strip() for x in text.split("|") if x.strip()]:
+        card = token[0:1].lower() + token[1:].upper()
+        if card not in DECK:
+            raise RangeError("Invalid board card: %s" % token)
+        cards.append(card)
+    if len(set(cards)) != len(cards):
+        raise RangeError("A board can't have the same card twice.")
+    if len(cards) not in (0, 3, 4, 5):
+        raise RangeError("A board has 0, 3, 4 or 5 cards, not %d." % len(cards))
+    return cards
@@ -83,6 +83,29 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# NOTE: game_status deltas diff against the status sent before, kept in this
+#       cache(see poker.views._game_status_delta). a local memory cache is
+#       per process, with several workers a client is only sent deltas when
+#       it polls the same worker again, otherwise it gets full statuses.
+#       run more than one worker with a shared cache, e.g. memcached:
+#       CACHES = {
+#           'default': {
+#               'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#               'LOCATION': '127.0.0.1:11211',
+#           }
+#       }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -120,3 +143,29 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Query budgets
+# see poker/querybudget.py
+
+QUERY_BUDGET_ENABLED = DEBUG
+
+QUERY_BUDGET_STRICT = False
+
+# Bot players
+# see poker/bots.py
+
+BOT_FILL_DELAY = 30
+
+BOT_POOL_SIZE = 4
+
+BOT_QUEUE_SIZE = 100
+
+BOT_EQUITY_PROCESSES = 2
+
+BOT_DECISION_BUDGET = 0.05
+
+# Game snapshots
+# see poker/snapshot.py, written by `manage.py dump_game_snapshot`
+# and loaded at startup, None turns them off.
+
+GAME_SNAPSHOT_PATH = os.path.join(BASE_DIR, "game_snapshot.bin")
@@ -0,0 +1,194 @@
+"""binary snapshots of live games' seats
+
+after a restart every live table would have to be read back from the
+database (the game row and its seats) on its next poll. instead, the seats
+of the active games are dumped into a compact binary file before the restart
+(manage.py dump_game_snapshot) and memory-mapped back in at startup
+(see poker.apps), which costs nothing but reading the index of the file.
+
+the in-process state cache holds the seat rows of games, by game version:
+straight from the mmap-ed snapshot, or packed after serving a game_status.
+NOTE: only the seats are cached, a game's row is still read on every poll.
+      one indexed lookup, and the only way to know it hasn't moved on
+      (or been deleted) in another process, so a poll after a restart is
+      one query instead of two, not none. its seats come from the cache
+      as long as the game is at the cached version, so a stale snapshot
+      is simply read the usual way.
+NOTE: every change to a seat happens in the transaction which saves
+      a new version of its game, so the seats are validated along with it.
+
+the file format, little-endian:
+    header: magic, format version, number of games
+    index: (guid, version, offset of the record) per game, fixed width
+        so all of it is unpacked by a single struct call
+    records: one per game, see pack_seats.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from poker.models import GameStages
+
+MAGIC = b"PKGS"
+FORMAT_VERSION = 2
+# number of packed games kept around.
+GAME_STATE_CACHE_SIZE = 10000
+# the seat columns kept with a game, in this order.
+SEAT_FIELDS = ("user_guid", "position", "chips", "round_bet", "hand_bet", "voluntarily_played")
+
+_HEADER = struct.Struct("<4sHI")
+# guid(NUL padded, guids are 36 characters at most), version, offset.
+_INDEX_ENTRY = "36sII"
+# position, chips, round_bet, hand_bet, voluntarily_played.
+_SEAT = struct.Struct("<BiiiB")
+_LENGTH_8 = struct.Struct("<B")
+
+# guid -> (version, buffer, offset of the packed seats in buffer),
+# of the games packed after serving them, the most recent last.
+_states = OrderedDict()
+_states_lock = threading.Lock()
+# the same, of the games in the loaded snapshot.
+# NOTE: a plain dict, built in one go, loading is about as fast as
+#       unpacking the index.
+_snapshot_states = {}
+
+
+class SnapshotError(ValueError):
+    """the snapshot file can't be read."""
+    pass
+
+
+def _pack_string(value):
+    value = value.encode("utf-8")
+    return _LENGTH_8.pack(len(value)) + value
+
+
+def _unpack_string(buffer, offset):
+    size, = _LENGTH_8.unpack_from(buffer, offset)
+    offset += _LENGTH_8.size
+    return buffer[offset:offset + size].decode("utf-8"), offset + size
+
+
+def pack_seats(seats):
+    """returns the packed seat rows(values of SEAT_FIELDS): their number, then each seat."""
+    parts = [_LENGTH_8.pack(len(seats))]
+    for user_guid, position, chips, round_bet, hand_bet, voluntarily_played in seats:
+        parts.append(_SEAT.pack(position, chips, round_bet, hand_bet, voluntarily_played))
+        parts.append(_pack_string(user_guid))
+    return b"".join(parts)
+
+
+def unpack_seats(buffer, offset):
+    """returns the seat rows packed at offset, see pack_seats."""
+    count, = _LENGTH_8.unpack_from(buffer, offset)
+    offset += _LENGTH_8.size
+    seats = []
+    for x in range(0, count):
+        position, chips, round_bet, hand_bet, voluntarily_played = \
+            _SEAT.unpack_from(buffer, offset)
+        user_guid, offset = _unpack_string(buffer, offset + _SEAT.size)
+        seats.append((user_guid, position, chips, round_bet, hand_bet, bool(voluntarily_played)))
+    return seats
+
+
+def dump(path, games_with_seats):
+    """
+    writes the snapshot of the seats of games_with_seats, (game, seat rows)
+        pairs, to path.
+    the file is replaced at once, a loader never sees half of it.
+    returns the number of games written.
+    """
+    records = []
+    for game, seats in games_with_seats:
+        records.append((str(game.guid), game.version, pack_seats(seats)))
+    offset = _HEADER.size + struct.calcsize("<" + _INDEX_ENTRY) * len(records)
+    index = []
+    for guid, version, record in records:
+        index.extend((guid.encode("utf-8"), version, offset))
+        offset += len(record)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(records)))
+        f.write(struct.pack("<" + _INDEX_ENTRY * len(records), *index))
+        for guid, version, record in records:
+            f.write(record)
+    os.rename(temp_path, path)
+    return len(records)
+
+
+def load(path):
+    """
+    memory-maps the snapshot at path into the state cache(replacing the
+        snapshot loaded before), only the index is read,
+        seats are unpacked when their games are polled.
+    raises SnapshotError if the file is not a snapshot of this format.
+    returns the number of games loaded.
+    """
+    global _snapshot_states
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return 0
+        # the mapping stays valid after the file is closed.
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, format_version, count = _HEADER.unpack_from(buffer, 0)
+    except struct.error:
+        raise SnapshotError("Not a game snapshot: %s" % path)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise SnapshotError("Not a game snapshot of format %s: %s" % (FORMAT_VERSION, path))
+    index = struct.unpack_from("<" + _INDEX_ENTRY * count, buffer, _HEADER.size)
+    _snapshot_states = dict(zip(
+        [x.rstrip(b"\0").decode("utf-8") for x in index[0::3]],
+        zip(index[1::3], [buffer] * count, index[2::3])))
+    return count
+
+
+def remember(game, seats):
+    """keeps the packed seat rows of the game, at its version as saved."""
+    guid = str(game.guid)
+    with _states_lock:
+        state = _states.get(guid) or _snapshot_states.get(guid)
+    if state is not None and state[0] == game.version:
+        return
+    record = pack_seats(seats)
+    with _states_lock:
+        _states.pop(guid, None)
+        _states[guid] = (game.version, record, 0)
+        while len(_states) > GAME_STATE_CACHE_SIZE:
+            _states.popitem(last=False)
+
+
+def forget_all():
+    global _snapshot_states
+    with _states_lock:
+        _states.clear()
+    _snapshot_states = {}
+
+
+def get_cached(guid, version):
+    """returns the cached seat rows of the game at version, or None."""
+    with _states_lock:
+        state = _states.get(guid)
+    if state is None:
+        state = _snapshot_states.get(guid)
+    if state is None or state[0] != version:
+        return None
+    return unpack_seats(state[1], state[2])
+
+
+def get_seats(game):
+    """
+    the seat rows(values of SEAT_FIELDS) of the game, by position,
+        read from the database only if the cached ones are not current.
+    """
+    if game.stage == GameStages.Initial:
+        # seats are only created with the pocket cards.
+        return []
+    cached = get_cached(str(game.guid), game.version)
+    if cached is not None:
+        return cached
+    return list(game.seats.order_by("position").values_list(*SEAT_FIELDS))
@@ -0,0 +1,752 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils.six import StringIO
+
+from poker import bots, snapshot, tournament, views
+from poker.equity import equity_progress
+from poker.handeval import FLUSH, FULL_HOUSE, STRAIGHT, score_hand
+from poker.models import STARTING_CHIPS, BettingStatus, FrenchDeck, Game, GameStages, PlayerStats, Seat, Tournament
+from poker.pots import calculate_pots, distribute_pots
+from poker.querybudget import QueryBudgetTestMixin
+from poker.ranges import DECK, RangeError, parse_board, parse_range
+
+
+class GameTestCase(QueryBudgetTestMixin, TestCase):
+
+    def setUp(self):
+        super(GameTestCase, self).setUp()
+        # both are per process, games of other tests must not show up.
+        snapshot.forget_all()
+        cache.clear()
+
+    def poll(self, user_guid, game_guid=None, since_version=None):
+        params = {"user_guid": user_guid}
+        if game_guid:
+            params["game_guid"] = game_guid
+        if since_version is not None:
+            params["since_version"] = since_version
+        return self.client.get("/game/status/", params)
+
+    def act(self, game_guid, user_guid, action_type="C", amount=0):
+        return self.client.post("/user/action/", {
+            "game_guid": game_guid, "user_guid": user_guid,
+            "action_type": action_type, "amount": amount})
+
+    def start_game(self):
+        """returns the guid of a game of u1 and u2, pocket cards dealt."""
+        game_guid = json.loads(self.poll("u1").content)["game_guid"]
+        self.poll("u2")
+        return game_guid
+
+
+class GameStatusQueriesTest(GameTestCase):
+
+    def test_new_game(self):
+        response = self.poll("u1")
+        self.assertNumQueriesReported(response, 2)
+        self.assertEqual(json.loads(response.content)["stage"], GameStages.Initial)
+
+    def test_join_deals_pocket_cards(self):
+        self.poll("u1")
+        response = self.poll("u2")
+        self.assertNumQueriesReported(response, 7)
+        self.assertEqual(json.loads(response.content)["stage"], GameStages.PocketDone)
+
+    def test_polls(self):
+        game_guid = self.start_game()
+        response = self.poll("u1", game_guid)
+        # the seats are only remembered once a transaction commits,
+        # which never happens within a TestCase.
+        self.assertNumQueriesReported(response, 2)
+        version = json.loads(response.content)["version"]
+        response = self.poll("u1", game_guid, since_version=version)
+        self.assertNumQueriesReported(response, 1)
+        self.assertEqual(json.loads(response.content),
+                         {"game_guid": game_guid, "version": version, "delta": True})
+
+    def test_streets_and_showdown(self):
+        game_guid = self.start_game()
+        for stage in (GameStages.FLopDone, GameStages.TurnDone, GameStages.RiverDone):
+            self.act(game_guid, "u1")
+            self.act(game_guid, "u2")
+            response = self.poll("u1", game_guid)
+            self.assertNumQueriesReported(response, 6)
+            self.assertEqual(json.loads(response.content)["stage"], stage)
+        self.act(game_guid, "u1")
+        self.act(game_guid, "u2")
+        response = self.poll("u1", game_guid)
+        self.assertNumQueriesReported(response, 8)
+        self.assertEqual(json.loads(response.content)["stage"], GameStages.GameOver)
+
+
+class GameStatusDeltaTest(GameTestCase):
+
+    def play_street(self, game_guid):
+        """returns the version u1 saw before the street was dealt, and the new status."""
+        version = json.loads(self.poll("u1", game_guid).content)["version"]
+        self.act(game_guid, "u1")
+        self.act(game_guid, "u2")
+        return version, json.loads(self.poll("u1", game_guid, since_version=version).content)
+
+    def test_community_cards_added(self):
+        game_guid = self.start_game()
+        version, flop = self.play_street(game_guid)
+        self.assertTrue(flop["delta"])
+        self.assertEqual(flop["stage"], GameStages.FLopDone)
+        self.assertEqual(len(flop["community_cards"].split("|")), 3)
+        version, turn = self.play_street(game_guid)
+        self.assertTrue(turn["delta"])
+        self.assertNotIn("community_cards", turn)
+        community_cards = Game.objects.get(guid=game_guid).community_cards
+        self.assertEqual(community_cards, flop["community_cards"] + "|" + turn["community_cards_added"])
+        self.assertNotIn("user_pocket_cards", turn)
+
+    def test_too_far_behind(self):
+        game_guid = self.start_game()
+        status = json.loads(self.poll("u1", game_guid).content)
+        since_version = status["version"] - views.MAX_DELTA_VERSION_GAP - 1
+        cache.set(views._game_status_cache_key(game_guid, "u1", since_version), status)
+        status = json.loads(self.poll("u1", game_guid, since_version=since_version).content)
+        self.assertFalse(status["delta"])
+        self.assertIn("user_pocket_cards", status)
+
+    def test_not_cached(self):
+        game_guid = self.start_game()
+        version = json.loads(self.poll("u1", game_guid).content)["version"]
+        self.act(game_guid, "u1")
+        cache.clear()
+        status = json.loads(self.poll("u1", game_guid, since_version=version).content)
+        self.assertFalse(status["delta"])
+        self.assertIn("user_pocket_cards", status)
+
+    def test_removed_keys(self):
+        # a tournament table back to Initial has no chips dealt.
+        previous = {"game_guid": "g", "version": 1, "stage": GameStages.RiverDone,
+                    "pot_value": 40, "player_stake": 980}
+        views._game_status_delta(previous, "u1")
+        delta = views._game_status_delta(
+            {"game_guid": "g", "version": 2, "stage": GameStages.Initial}, "u1", since_version=1)
+        self.assertEqual(delta, {"game_guid": "g", "version": 2, "delta": True,
+                                 "stage": GameStages.Initial,
+                                 "pot_value": None, "player_stake": None})
+
+
+class UserActionQueriesTest(GameTestCase):
+
+    def test_check(self):
+        game_guid = self.start_game()
+        response = self.act(game_guid, "u1")
+        self.assertNumQueriesReported(response, 3)
+        self.assertEqual(json.loads(response.content)["type"], "Success")
+
+    def test_call_all_in(self):
+        game_guid = self.start_game()
+        game = Game.objects.get(guid=game_guid)
+        Seat.objects.filter(game=game, position=1).update(round_bet=50, hand_bet=50, chips=950)
+        Seat.objects.filter(game=game, position=0).update(chips=10)
+        response = self.act(game_guid, "u1")
+        self.assertNumQueriesReported(response, 8)
+        self.assertEqual(Seat.objects.get(game=game, position=0).chips, 0)
+
+    def test_not_your_turn(self):
+        game_guid = self.start_game()
+        response = self.act(game_guid, "u2")
+        self.assertNumQueriesReported(response, 1)
+        self.assertEqual(json.loads(response.content)["message"], "Not your turn.")
+
+
+class BettingTest(GameTestCase):
+
+    def status(self, game_guid):
+        return json.loads(self.poll("u1", game_guid).content)
+
+    def chips(self, game_guid):
+        return sum(Seat.objects.filter(game__guid=game_guid).values_list("chips", flat=True))
+
+    def test_bet_reopens_the_betting_round(self):
+        game_guid = self.start_game()
+        self.act(game_guid, "u1")
+        self.act(game_guid, "u2", "B", 50)
+        status = self.status(game_guid)
+        self.assertEqual(status["stage"], GameStages.PocketDone)
+        self.assertEqual(status["betting_status"], "NB")
+        self.assertEqual(status["player_to_action"], "u1")
+        self.act(game_guid, "u1")
+        status = self.status(game_guid)
+        self.assertEqual(status["stage"], GameStages.FLopDone)
+        self.assertEqual(status["pot_value"], 100)
+
+    def test_raise_keeps_folds(self):
+        game = Game(total_num_of_players=3, player_guids="u1|u2|u3", player_to_action="u1")
+        game.save()
+        game_guid = str(game.move_to_next_stage_if_ready().guid)
+        self.act(game_guid, "u1", "F")
+        self.act(game_guid, "u2")
+        self.act(game_guid, "u3", "B", 20)
+        self.assertEqual(Game.objects.get(guid=game_guid).betting_status, "FNB")
+
+    def test_bet_too_small(self):
+        game_guid = self.start_game()
+        self.act(game_guid, "u1", "B", 50)
+        for amount in (30, 0):
+            response = self.act(game_guid, "u2", "R", amount)
+            self.assertEqual(json.loads(response.content)["message"], "Bet too small.")
+        response = self.act(game_guid, "u2", "R", 50)
+        self.assertEqual(json.loads(response.content)["type"], "Success")
+        # matching the bet is a call, the betting round is over.
+        self.assertEqual(self.status(game_guid)["stage"], GameStages.FLopDone)
+
+    def test_chips_are_conserved_when_a_bet_is_folded_to(self):
+        game_guid = self.start_game()
+        self.act(game_guid, "u1")
+        self.act(game_guid, "u2", "B", 30)
+        self.act(game_guid, "u1", "F")
+        while self.status(game_guid)["stage"] != GameStages.GameOver:
+            self.act(game_guid, "u2")
+        self.assertEqual(self.chips(game_guid), 2000)
+        self.assertEqual(
+            Seat.objects.get(game__guid=game_guid, user_guid="u2").chips, 1000)
+
+
+class PlayerStatsTest(GameTestCase):
+
+    def stats(self, user_guid):
+        return PlayerStats.objects.get(user_guid=user_guid)
+
+    def play_to_showdown(self, game_guid):
+        while json.loads(self.poll("u1", game_guid).content)["stage"] != GameStages.GameOver:
+            game = Game.objects.get(guid=game_guid)
+            self.act(game_guid, game.player_to_action)
+
+    def test_increment(self):
+        PlayerStats.increment(["u1"], hands_played=1)
+        PlayerStats.increment(["u1", "u2"], hands_played=2, flops_seen=1)
+        self.assertEqual(self.stats("u1").hands_played, 3)
+        self.assertEqual(self.stats("u1").flops_seen, 1)
+        self.assertEqual(self.stats("u2").hands_played, 2)
+
+    def test_increment_created_in_the_meantime(self):
+        manager = PlayerStats.objects
+        real_bulk_create = manager.bulk_create
+
+        def bulk_create_racing(objs, *args, **kwargs):
+            # somebody else created the stats first, once.
+            manager.bulk_create = real_bulk_create
+            raise IntegrityError("UNIQUE constraint failed")
+
+        manager.bulk_create = bulk_create_racing
+        self.addCleanup(lambda: manager.__dict__.pop("bulk_create", None))
+        PlayerStats.increment(["u1"], hands_played=1)
+        self.assertEqual(self.stats("u1").hands_played, 1)
+
+    def test_vpip_counts_once_per_hand_preflop(self):
+        game_guid = self.start_game()
+        self.act(game_guid, "u1", "B", 20)
+        self.act(game_guid, "u2", "R", 60)
+        self.act(game_guid, "u1", "R", 80)
+        self.act(game_guid, "u2")
+        self.poll("u1", game_guid)
+        # chips put in after the flop don't count.
+        self.act(game_guid, "u1", "B", 20)
+        self.assertEqual(self.stats("u1").vpip_hands, 1)
+        self.assertEqual(self.stats("u2").vpip_hands, 1)
+
+    def test_checks_are_not_vpip(self):
+        game_guid = self.start_game()
+        self.act(game_guid, "u1")
+        self.act(game_guid, "u2")
+        self.assertEqual(self.stats("u1").vpip_hands, 0)
+
+    def test_streets_seen_by_the_players_still_in(self):
+        game = Game(total_num_of_players=3, player_guids="u1|u2|u3", player_to_action="u1")
+        game.save()
+        game_guid = str(game.move_to_next_stage_if_ready().guid)
+        self.act(game_guid, "u1", "F")
+        self.play_to_showdown(game_guid)
+        u1, u2 = self.stats("u1"), self.stats("u2")
+        self.assertEqual((u1.hands_played, u1.flops_seen, u1.showdowns_seen), (1, 0, 0))
+        self.assertEqual(
+            (u2.hands_played, u2.flops_seen, u2.turns_seen, u2.rivers_seen, u2.showdowns_seen),
+            (1, 1, 1, 1, 1))
+
+    def test_player_stats_view(self):
+        PlayerStats.increment(
+            ["u1"], hands_played=4, vpip_hands=1, showdowns_seen=2, showdowns_won=1)
+        response = self.client.get("/player/stats/", {"user_guid": "u1"})
+        self.assertNumQueriesReported(response, 1)
+        stats = json.loads(response.content)
+        self.assertEqual((stats["vpip"], stats["showdown_win_rate"]), (0.25, 0.5))
+        response = self.client.get("/player/stats/", {"user_guid": "nobody"})
+        self.assertEqual(json.loads(response.content)["message"], "No stats for this user.")
+
+    def test_leaderboard(self):
+        PlayerStats.increment(["u1"], hands_played=1, showdowns_won=3)
+        PlayerStats.increment(["u2"], hands_played=5, showdowns_won=1)
+        response = self.client.get("/leaderboard/")
+        self.assertNumQueriesReported(response, 1)
+        self.assertEqual([x["user_guid"] for x in json.loads(response.content)["players"]],
+                         ["u1", "u2"])
+        response = self.client.get("/leaderboard/", {"order_by": "hands_played"})
+        self.assertEqual([x["user_guid"] for x in json.loads(response.content)["players"]],
+                         ["u2", "u1"])
+        response = self.client.get("/leaderboard/", {"order_by": "vpip_hands"})
+        self.assertEqual(json.loads(response.content)["type"], "Error")
+
+    def test_backfill(self):
+        game_guid = self.start_game()
+        self.act(game_guid, "u1", "B", 20)
+        self.play_to_showdown(game_guid)
+        # a game not over yet isn't replayed.
+        self.start_game()
+        live = dict((x.user_guid, x.as_dict()) for x in PlayerStats.objects.all())
+
+        self.assertRaises(CommandError, call_command, "backfill_player_stats")
+        call_command("backfill_player_stats", reset=True, stdout=StringIO())
+        for user_guid in ("u1", "u2"):
+            stats = self.stats(user_guid).as_dict()
+            for counter in ("showdowns_seen", "showdowns_won"):
+                self.assertEqual(stats[counter], live[user_guid][counter])
+            self.assertEqual(stats["hands_played"], 1)
+            # only counted live, see the command.
+            self.assertEqual(stats["flops_seen"], 0)
+        self.assertEqual(self.stats("u1").vpip_hands, 1)
+
+        call_command("backfill_player_stats", until_game_id=0, stdout=StringIO())
+        self.assertEqual(self.stats("u1").hands_played, 1)
+
+
+class JoinGameQueriesTest(GameTestCase):
+
+    def join(self, game_guid, name):
+        return self.client.post(
+            "/join/", json.dumps({"game_guid": game_guid, "name": name}),
+            content_type="application/json")
+
+    def test_new_game(self):
+        response = self.join("new-game", "bob")
+        self.assertNumQueriesReported(response, 3)
+        self.assertIn("player_guid", json.loads(response.content))
+
+    def test_game_ready_to_deal(self):
+        game = Game(total_num_of_players=2, player_guids="u1|u2", player_to_action="u1")
+        game.save()
+        response = self.join(str(game.guid), "bob")
+        self.assertNumQueriesReported(response, 9)
+        self.assertEqual(json.loads(response.content)["stage"], GameStages.PocketDone)
+
+
+@override_settings(BOT_POOL_SIZE=0, BOT_EQUITY_PROCESSES=0, BOT_FILL_DELAY=0)
+class BotQueriesTest(QueryBudgetTestMixin, TransactionTestCase):
+    """bots deciding in the request's thread, once its transaction commits."""
+
+    def setUp(self):
+        super(BotQueriesTest, self).setUp()
+        snapshot.forget_all()
+        cache.clear()
+
+    def test_bot_is_not_counted(self):
+        status = json.loads(self.client.get("/game/status/", {"user_guid": "h1"}).content)
+        self.assertEqual(status["player_to_action"], "h1")
+        response = self.client.post("/user/action/", {
+            "game_guid": status["game_guid"], "user_guid": "h1", "action_type": "C"})
+        self.assertNumQueriesReported(response, 3)
+        # the bot acted too, it's h1's turn again.
+        game = Game.objects.get(guid=status["game_guid"])
+        self.assertGreaterEqual(game.version, status["version"] + 2)
+        self.assertEqual(game.player_to_action, "h1")
+
+
+class BotTest(TestCase):
+
+    def setUp(self):
+        bots._equity_cache.clear()
+        self.addCleanup(bots._equity_cache.clear)
+        self.bot_guid = bots.new_bot_guid()
+
+    def deal(self, bot_chips=STARTING_CHIPS, to_call=0, equity=0.5):
+        """a dealt game of u1 and the bot, the bot to act facing to_call, its equity set."""
+        game = Game(total_num_of_players=2, player_guids="u1|" + self.bot_guid,
+                    player_to_action=self.bot_guid)
+        game.save()
+        game = game.move_to_next_stage_if_ready()
+        game.player_to_action = self.bot_guid
+        game.save()
+        game.seats.filter(position=0).update(
+            chips=STARTING_CHIPS - to_call, round_bet=to_call, hand_bet=to_call)
+        game.seats.filter(position=1).update(chips=bot_chips)
+        pocket = game.get_user_pocket_cards(self.bot_guid).split("|")
+        bots._equity_cache[(tuple(sorted(pocket)), (), 1)] = equity
+        return game
+
+    def test_raises_a_strong_hand(self):
+        game = self.deal(to_call=40, equity=0.8)
+        # half the pot on top of the call.
+        self.assertEqual(bots.decide(game, self.bot_guid), (BettingStatus.Reraise, 60))
+
+    def test_calls_at_the_right_price(self):
+        # 50 to call into a pot of 50 pays off with half of the pot after the call.
+        game = self.deal(to_call=50, equity=0.5)
+        self.assertEqual(bots.decide(game, self.bot_guid), (BettingStatus.Call_Or_Check, 0))
+
+    def test_folds_at_the_wrong_price(self):
+        game = self.deal(to_call=50, equity=0.45)
+        self.assertEqual(bots.decide(game, self.bot_guid), (BettingStatus.Fold, 0))
+
+    def test_checks_for_free(self):
+        game = self.deal(equity=0.1)
+        self.assertEqual(bots.decide(game, self.bot_guid), (BettingStatus.Call_Or_Check, 0))
+
+    def test_calls_all_in(self):
+        # can't raise with less chips than the call, calling is all-in.
+        game = self.deal(bot_chips=30, to_call=50, equity=0.9)
+        self.assertEqual(bots.decide(game, self.bot_guid), (BettingStatus.Call_Or_Check, 0))
+        game.record_action(self.bot_guid, BettingStatus.Call_Or_Check)
+        self.assertEqual(game.seats.get(position=1).chips, 0)
+        self.assertEqual(game.seats.get(position=1).hand_bet, 30)
+
+    @override_settings(BOT_EQUITY_PROCESSES=0)
+    def test_equity_cache(self):
+        deadline = time.time() + 0.01
+        equity = bots._cached_equity(["hA", "sA"], [], 1, deadline)
+        self.assertTrue(0.5 < equity <= 1)
+        self.assertEqual(list(bots._equity_cache.values()), [equity])
+        # the same spot, whatever the order of the cards.
+        self.assertEqual(bots._cached_equity(["sA", "hA"], [], 1, deadline), equity)
+        self.assertEqual(len(bots._equity_cache), 1)
+
+    @override_settings(BOT_EQUITY_PROCESSES=0)
+    def test_equity_cache_size(self):
+        self.addCleanup(setattr, bots, "EQUITY_CACHE_SIZE", bots.EQUITY_CACHE_SIZE)
+        bots.EQUITY_CACHE_SIZE = 2
+        for pocket in (["hA", "sA"], ["hK", "sK"], ["hQ", "sQ"]):
+            bots._cached_equity(pocket, [], 1, time.time())
+        self.assertEqual([x[0] for x in bots._equity_cache],
+                         [("hK", "sK"), ("hQ", "sQ")])
+
+    def test_needs_bots(self):
+        game = Game(total_num_of_players=1, player_guids="u1", player_to_action="u1")
+        game.save()
+        self.assertFalse(bots.needs_bots(game))
+        with override_settings(BOT_FILL_DELAY=0):
+            self.assertTrue(bots.needs_bots(game))
+            game.tournament = Tournament.objects.create()
+            self.assertFalse(bots.needs_bots(game))
+
+    @override_settings(BOT_FILL_DELAY=0)
+    def test_fill_with_bots(self):
+        game = Game(total_num_of_players=1, player_guids="u1", player_to_action="u1")
+        self.assertTrue(bots.fill_with_bots(game))
+        players = game.player_guids.split("|")
+        self.assertEqual(game.total_num_of_players, len(players))
+        self.assertEqual(players[0], "u1")
+        self.assertTrue(all(bots.is_bot(x) for x in players[1:]))
+        self.assertTrue(game._is_next_stage_ready())
+        self.assertFalse(bots.fill_with_bots(game))
+
+    def test_nothing_pending_after_a_rollback(self):
+        game = self.deal()
+        try:
+            with transaction.atomic():
+                bots.play_if_bot_to_act(game)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(bots._pending, set())
+
+    @override_settings(BOT_POOL_SIZE=0, BOT_QUEUE_SIZE=0)
+    def test_full_queue(self):
+        game = self.deal()
+        bots._hand_over(game.pk, self.bot_guid, game.version)
+        self.assertEqual(Game.objects.get(pk=game.pk).version, game.version)
+        self.assertEqual(bots._pending, set())
+
+
+class HandOrderTest(SimpleTestCase):
+
+    def test_wheel(self):
+        wheel = score_hand(["hA", "d2", "c3", "s4", "h5", "dK", "cK"])
+        self.assertEqual(wheel, (STRAIGHT, 5))
+        self.assertLess(wheel, score_hand(["h2", "d3", "c4", "s5", "h6"]))
+        self.assertGreater(wheel, score_hand(["hK", "dK", "cK", "s4", "h9"]))
+
+    def test_two_trips(self):
+        # the lower trips are the pair part of the full house.
+        self.assertEqual(score_hand(["h9", "d9", "c9", "s4", "h4", "d4", "cA"]),
+                         (FULL_HOUSE, 9, 4))
+
+    def test_flush_beats_straight(self):
+        flush = score_hand(["h2", "h7", "h9", "hJ", "hK", "d8", "cT"])
+        self.assertEqual(flush[0], FLUSH)
+        self.assertGreater(flush, score_hand(["h7", "d8", "c9", "sT", "hJ"]))
+
+    def test_kickers(self):
+        self.assertGreater(score_hand(["hA", "dA", "c9", "s7", "h5"]),
+                           score_hand(["sA", "cA", "d9", "h7", "d4"]))
+        self.assertEqual(score_hand(["hA", "dA", "c9", "s7", "h5"]),
+                         score_hand(["sA", "cA", "d9", "h7", "d5"]))
+
+
+class TournamentTest(TestCase):
+
+    def setUp(self):
+        self.tournament = Tournament.objects.create(table_size=3)
+
+    def start(self, num_of_players):
+        tournament.register(self.tournament, ["p%d" % x for x in range(num_of_players)])
+        return tournament.seat_entrants(self.tournament)
+
+    def sizes(self):
+        return sorted(self.tournament.tables.values_list("total_num_of_players", flat=True))
+
+    def assertSeatedAsEntries(self):
+        """every player of a table is seated there by his entry, and nobody else."""
+        seated = {}
+        for table in self.tournament.tables.all():
+            for user_guid in table.player_guids.split("|"):
+                seated[user_guid] = table.pk
+        entries = dict(self.tournament.entries.filter(eliminated=False).values_list(
+            "user_guid", "game_id"))
+        self.assertEqual(seated, entries)
+
+    def play_hands(self):
+        """everybody checks or calls until every hand is over."""
+        while self.tournament.tables.exclude(stage=GameStages.GameOver).exists():
+            for table in self.tournament.tables.exclude(stage=GameStages.GameOver):
+                while "N" in table.betting_status:
+                    table.record_action(table.player_to_action, "C")
+            tournament.deal_next_stage(self.tournament)
+
+    def total_chips(self):
+        return sum(Seat.objects.filter(game__tournament=self.tournament).values_list(
+            "chips", flat=True))
+
+    def test_seat_entrants(self):
+        self.assertEqual(self.start(7), 3)
+        self.assertEqual(self.sizes(), [2, 2, 3])
+        self.assertSeatedAsEntries()
+        # nobody left to seat.
+        self.assertEqual(tournament.seat_entrants(self.tournament), 0)
+
+    def test_deal_posts_the_blinds(self):
+        self.start(6)
+        self.assertEqual(tournament.deal_next_stage(self.tournament), 2)
+        small_blind, big_blind = tournament.get_blinds(self.tournament)
+        for table in self.tournament.tables.all():
+            self.assertEqual(table.stage, GameStages.PocketDone)
+            self.assertEqual(
+                list(table.seats.order_by("position").values_list("chips", "round_bet")),
+                [(STARTING_CHIPS - small_blind, small_blind),
+                 (STARTING_CHIPS - big_blind, big_blind),
+                 (STARTING_CHIPS, 0)])
+        # betting isn't over, there is nothing to deal.
+        self.assertEqual(tournament.deal_next_stage(self.tournament), 0)
+
+    def test_showdowns_keep_the_chips(self):
+        self.start(8)
+        tournament.deal_next_stage(self.tournament)
+        self.play_hands()
+        self.assertEqual(self.total_chips(), 8 * STARTING_CHIPS)
+        self.assertFalse(Seat.objects.exclude(hand_bet=0).exists())
+
+    def test_start_next_hands_moves_the_button(self):
+        self.start(3)
+        table = self.tournament.tables.get()
+        players = table.player_guids.split("|")
+        tournament.deal_next_stage(self.tournament)
+        self.play_hands()
+        self.assertEqual(tournament.start_next_hands(self.tournament), 1)
+        self.assertEqual(
+            sum(self.tournament.entries.values_list("chips", flat=True)), 3 * STARTING_CHIPS)
+        table = self.tournament.tables.get()
+        self.assertEqual(table.stage, GameStages.Initial)
+        self.assertEqual(table.player_guids.split("|"), players[1:] + players[:1])
+        self.assertFalse(table.seats.exists())
+
+    def test_busted_players_are_out(self):
+        self.start(3)
+        tournament.deal_next_stage(self.tournament)
+        self.play_hands()
+        table = self.tournament.tables.get()
+        busted = table.player_guids.split("|")[2]
+        table.seats.filter(user_guid=busted).update(chips=0)
+        tournament.start_next_hands(self.tournament)
+        self.assertNotIn(busted, self.tournament.tables.get().player_guids.split("|"))
+        self.assertTrue(self.tournament.entries.get(user_guid=busted).eliminated)
+        self.assertSeatedAsEntries()
+
+    def remove_players(self, table, num_of_players):
+        user_guids = table.player_guids.split("|")
+        self.tournament.entries.filter(user_guid__in=user_guids[:num_of_players]).update(
+            eliminated=True, game=None)
+        tournament._set_players(table, user_guids[num_of_players:])
+        table.save()
+
+    def test_rebalance_breaks_a_table(self):
+        self.start(9)
+        small, middle, full = self.tournament.tables.order_by("pk")
+        self.remove_players(small, 2)
+        self.remove_players(middle, 1)
+        self.assertEqual(tournament.rebalance(self.tournament), 1)
+        self.assertEqual(self.sizes(), [3, 3])
+        self.assertFalse(Game.objects.filter(pk=small.pk).exists())
+        self.assertSeatedAsEntries()
+
+    def test_rebalance_evens_out_tables(self):
+        self.start(9)
+        small = self.tournament.tables.order_by("pk")[0]
+        self.remove_players(small, 2)
+        self.assertEqual(tournament.rebalance(self.tournament), 1)
+        self.assertEqual(self.sizes(), [2, 2, 3])
+        self.assertSeatedAsEntries()
+        # balanced already.
+        self.assertEqual(tournament.rebalance(self.tournament), 0)
+
+
+class PotsTest(SimpleTestCase):
+
+    def test_side_pot_with_folded_and_all_in(self):
+        # A all-in for 50, B and C call 100, D folded after 30.
+        pots = calculate_pots([50, 100, 100, 30], folded=[3])
+        self.assertEqual(pots, [(180, [0, 1, 2]), (100, [1, 2])])
+        # A has the best hand but only wins the main pot.
+        winnings = distribute_pots(pots, {0: (3,), 1: (2,), 2: (1,)})
+        self.assertEqual(winnings, {0: 180, 1: 100})
+
+    def test_folded_chips_above_the_live_level(self):
+        # the folded player put in more than the one still in.
+        self.assertEqual(calculate_pots([100, 50], folded=[0]), [(150, [1])])
+
+    def test_folded_chips_nobody_still_in_matched(self):
+        # the only player still in never put any chips in.
+        pots = calculate_pots([0, 30], folded=[1])
+        self.assertEqual(pots, [(30, [0])])
+        self.assertEqual(distribute_pots(pots, {0: (1,)}), {0: 30})
+
+    def test_everybody_folded(self):
+        pots = calculate_pots([20, 30, 0], folded=[0, 1, 2])
+        self.assertEqual(distribute_pots(pots, {}), {0: 20, 1: 30})
+
+    def test_odd_chips_in_order_of_position(self):
+        scores = {0: (1,), 1: (5,), 2: (5,), 3: (5,)}
+        self.assertEqual(distribute_pots([(101, [0, 1, 2, 3])], scores),
+                         {1: 34, 2: 34, 3: 33})
+        self.assertEqual(distribute_pots([(101, [0, 2])], scores), {2: 101})
+
+    def test_chips_are_conserved(self):
+        contributions = [37, 200, 5, 200, 81]
+        pots = calculate_pots(contributions, folded=[2])
+        winnings = distribute_pots(pots, {0: (9,), 1: (4,), 3: (4,), 4: (2,)})
+        self.assertEqual(sum(amount for amount, eligible in pots), sum(contributions))
+        self.assertEqual(sum(winnings.values()), sum(contributions))
+
+
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+        snapshot.forget_all()
+        self.addCleanup(snapshot.forget_all)
+        self.game = Game(total_num_of_players=2, player_guids="u1|u2", player_to_action="u1")
+        self.game.save()
+        self.game = self.game.move_to_next_stage_if_ready()
+        self.seats = [
+            ("u1", 0, 950, 0, 50, True),
+            ("u2", 1, 0, 20, 1000, True),
+        ]
+
+    def test_pack_unpack(self):
+        self.assertEqual(snapshot.unpack_seats(snapshot.pack_seats(self.seats), 0), self.seats)
+
+    def test_dump_load(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "games.snapshot")
+        self.assertEqual(snapshot.dump(path, [(self.game, self.seats)]), 1)
+        self.assertEqual(snapshot.load(path), 1)
+        self.assertEqual(snapshot.get_cached(str(self.game.guid), self.game.version), self.seats)
+        self.assertIsNone(snapshot.get_cached(str(self.game.guid), self.game.version + 1))
+
+    def test_seats_are_served_while_current(self):
+        snapshot.remember(self.game, self.seats)
+        with self.assertNumQueries(0):
+            self.assertEqual(snapshot.get_seats(self.game), self.seats)
+        # a newer version of the game is read from the database.
+        self.game.save()
+        with self.assertNumQueries(1):
+            seats = snapshot.get_seats(self.game)
+        self.assertEqual([x[:3] for x in seats], [("u1", 0, 1000), ("u2", 1, 1000)])
+
+    def test_not_a_snapshot(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "games.snapshot")
+        with open(path, "wb") as f:
+            f.write(b"PKGS\x01\x00\x00\x00\x00\x00")
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, path)
+
+
+class RangesTest(SimpleTestCase):
+
+    def test_hands(self):
+        self.assertEqual(len(parse_range("QQ+")), 18)
+        self.assertEqual(len(parse_range("ATs+")), 16)
+        self.assertEqual(len(parse_range("KTo-K7o")), 48)
+        self.assertEqual(parse_range("AhKh"), set([("hA", "hK")]))
+        self.assertEqual(len(parse_range("any pair")), 78)
+        self.assertEqual(len(parse_range("any")), 1326)
+        self.assertEqual(parse_range("QQ+, AKs"), parse_range("AA, KK, QQ, AKs"))
+
+    def test_dead_cards(self):
+        board = parse_board("hA|d7|c2")
+        self.assertEqual(len(parse_range("AA", board)), 3)
+        self.assertEqual(len(parse_range("AKs", board)), 3)
+        self.assertEqual(parse_range("AhKh", board), set())
+
+    def test_malformed(self):
+        for text in ("", "QQs", "XYZ", "AhAh", "QQ-AKs", "A1s"):
+            self.assertRaises(RangeError, parse_range, text)
+
+    def test_board(self):
+        self.assertEqual(parse_board(""), [])
+        self.assertEqual(parse_board("hq|D7|c2"), ["hQ", "d7", "c2"])
+        for text in ("hQ|d7", "hQ|d7|hQ", "hQ|d7|c1", "hQ|d7|c2|s3|s4|s5"):
+            self.assertRaises(RangeError, parse_board, text)
+
+
+class EquityTest(GameTestCase):
+
+    def equity(self, **params):
+        response = self.client.get("/equity/", params)
+        if response.streaming:
+            return [json.loads(x) for x in b"".join(response.streaming_content).splitlines()]
+        return json.loads(response.content)
+
+    def test_exact(self):
+        board = parse_board("hQ|d7|c2|s3")
+        estimates = list(equity_progress(parse_range("AA", board), parse_range("KK", board), board))
+        self.assertTrue(estimates[-1]["exact"])
+        self.assertAlmostEqual(estimates[-1]["equity"], 42.0 / 44)
+        self.assertFalse(any(x["exact"] for x in estimates[:-1]))
+
+    def test_board_of_a_game(self):
+        game = Game.objects.create(community_cards="hQ|d7|c2|s3")
+        estimates = self.equity(game_guid=game.guid, hero="AA", villain="KK")
+        self.assertAlmostEqual(estimates[-1]["equity"], 42.0 / 44)
+
+    def test_games_deal_from_52_cards(self):
+        self.assertEqual(sorted(FrenchDeck.next_random_cards(52)), sorted(DECK))
+        self.assertEqual(len(set(DECK)), 52)
+
+    def test_errors(self):
+        old_game = Game.objects.create(community_cards="hQ|d1|c2")
+        self.assertIn("old 56 card deck", self.equity(game_guid=old_game.guid, hero="AA", villain="KK")["message"])
+        self.assertEqual(self.equity(board="hQ|d7", hero="AA", villain="KK")["type"], "Error")
+        self.assertEqual(self.equity(board="hA|d7|c2", hero="AhKh", villain="KK")["type"], "Error")
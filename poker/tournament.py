@@ -0,0 +1,348 @@
+"""multi-table tournaments
+
+the tables of a tournament are ordinary Games, played the usual way.
+what's different is that a tournament has thousands of them,
+so nothing in here saves games or entries one by one:
+rows are created with bulk_create and changed with one UPDATE per batch
+(see _bulk_update), each batch of tables in its own transaction.
+deal_next_stage is the dealer of the tables, polls never start a hand at
+a tournament table(see Game.move_to_next_stage_if_ready).
+
+the life of a tournament:
+    register(tournament, user_guids)
+    seat_entrants(tournament)
+    deal_next_stage(tournament)  # again and again as tables finish betting,
+                                 # showdowns included
+    start_next_hands(tournament)  # once tables are over
+    rebalance(tournament)
+    advance_level(tournament)  # every so often
+"""
+
+import random
+import uuid
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Value, When
+
+from poker.models import (
+    Game, GameStages, PlayerStats, Seat, Tournament, TournamentEntry, showdown_winners)
+from poker.pots import calculate_pots, distribute_pots
+
+# (small blind, big blind) of each level.
+BLIND_LEVELS = [
+    (10, 20), (15, 30), (25, 50), (50, 100), (75, 150),
+    (100, 200), (150, 300), (200, 400), (300, 600), (500, 1000),
+]
+# tables handled per batch, and per transaction.
+# NOTE: keep the batches small enough for the database's limit of
+#       parameters per statement, sqlite allows 999 only.
+TABLE_BATCH_SIZE = 50
+ENTRY_BATCH_SIZE = 500
+
+
+def _batches(items, size):
+    for x in range(0, len(items), size):
+        yield items[x:x + size]
+
+
+def _table_batches(tables):
+    """
+    yields the tables of the queryset TABLE_BATCH_SIZE at a time, by primary key.
+    each batch is yielded inside its own transaction with its rows locked,
+        so whatever the caller does with a batch is saved all or nothing
+        and no poll changes those tables in the meantime.
+    """
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(tables.select_for_update().filter(
+                pk__gt=last_pk).order_by("pk")[:TABLE_BATCH_SIZE])
+            if not batch:
+                return
+            yield batch
+        last_pk = batch[-1].pk
+
+
+def _bulk_update(objs, fields):
+    """
+    saves the given fields of objs(all of the same model) with a single UPDATE,
+        a CASE per field picks each row's value by primary key.
+    NOTE: Django 1.9 has no QuerySet.bulk_update.
+    """
+    if not objs:
+        return
+    model = type(objs[0])
+    values = {}
+    for name in fields:
+        field = model._meta.get_field(name)
+        values[field.attname] = Case(
+            *[When(pk=obj.pk, then=Value(getattr(obj, field.attname))) for obj in objs],
+            output_field=field.target_field if field.is_relation else field
+        )
+    model.objects.filter(pk__in=[obj.pk for obj in objs]).update(**values)
+
+
+def _move_entries(tournament, game_pks):
+    """
+    seats entries at other tables, game_pks is {user_guid: game pk or None},
+        one UPDATE no matter how many players move.
+    """
+    for user_guids in _batches(list(game_pks), ENTRY_BATCH_SIZE // 2):
+        tournament.entries.filter(user_guid__in=user_guids).update(game=Case(
+            *[When(user_guid=x, then=Value(game_pks[x])) for x in user_guids],
+            output_field=TournamentEntry._meta.get_field("game").target_field
+        ))
+
+
+def _set_players(game, user_guids):
+    game.player_guids = "|".join(user_guids)
+    game.total_num_of_players = len(user_guids)
+    game.player_to_action = user_guids[0] if user_guids else ""
+
+
+def get_blinds(tournament):
+    """(small blind, big blind) of the tournament's current level."""
+    return BLIND_LEVELS[min(tournament.level, len(BLIND_LEVELS) - 1)]
+
+
+def advance_level(tournament):
+    """moves the tournament up to the next blind level."""
+    Tournament.objects.filter(pk=tournament.pk).update(level=F("level") + 1)
+    tournament.level += 1
+
+
+def register(tournament, user_guids):
+    """registers the given players for the tournament."""
+    TournamentEntry.objects.bulk_create(
+        [TournamentEntry(tournament=tournament, user_guid=x) for x in user_guids],
+        batch_size=ENTRY_BATCH_SIZE,
+    )
+
+
+def seat_entrants(tournament):
+    """
+    seats all players not seated yet at new tables, in random order.
+    tables are filled evenly: their sizes differ by one player at most.
+    returns the number of tables created.
+    """
+    user_guids = list(tournament.entries.filter(
+        game__isnull=True, eliminated=False).values_list("user_guid", flat=True))
+    if not user_guids:
+        return 0
+    random.shuffle(user_guids)
+    num_of_tables = -(-len(user_guids) // tournament.table_size)
+    tables = []
+    for x in range(0, num_of_tables):
+        table = Game(tournament=tournament, guid=str(uuid.uuid4()), version=1)
+        _set_players(table, user_guids[x::num_of_tables])
+        tables.append(table)
+
+    for batch in _batches(tables, TABLE_BATCH_SIZE):
+        with transaction.atomic():
+            Game.objects.bulk_create(batch)
+            # bulk_create doesn't give back primary keys on every database.
+            game_pks = dict(Game.objects.filter(
+                guid__in=[table.guid for table in batch]).values_list("guid", "pk"))
+            _move_entries(tournament, dict(
+                (user_guid, game_pks[table.guid])
+                for table in batch for user_guid in table.player_guids.split("|")))
+    return num_of_tables
+
+
+def deal_next_stage(tournament):
+    """
+    moves every table of the tournament which is ready into its next stage,
+        dealing cards(and posting the blinds on a new hand) or going to
+        the showdown, in one pass over the tables.
+    returns the number of tables moved.
+    """
+    small_blind, big_blind = get_blinds(tournament)
+    moved_count = 0
+    tables = tournament.tables.exclude(stage=GameStages.GameOver)
+    for batch in _table_batches(tables):
+        moved = [table for table in batch if table._is_next_stage_ready()]
+        if not moved:
+            continue
+        showdowns = [table for table in moved if table.stage == GameStages.RiverDone]
+        new_hands = [table for table in moved if table.stage == GameStages.Initial]
+        next_rounds = [table for table in moved if table not in showdowns + new_hands]
+        still_in = dict((table.pk, [table._get_user_guid(x) for x in table._positions_still_in()])
+                        for table in moved)
+        for table in moved:
+            table.move_to_next_stage_if_ready(commit=False)
+            table.version += 1
+        _showdown(showdowns)
+        _bulk_update(moved, [
+            "pocket_cards", "community_cards", "stage",
+            "player_to_action", "betting_status", "version"])
+        Seat.objects.filter(game__in=next_rounds).update(round_bet=0)
+        for stage, counter in PlayerStats.STAGE_REACHED.items():
+            PlayerStats.increment(
+                [x for table in next_rounds if table.stage == stage
+                 for x in still_in[table.pk]], **{counter: 1})
+        if new_hands:
+            PlayerStats.increment(
+                [x for table in new_hands for x in still_in[table.pk]], hands_played=1)
+            _deal_seats(new_hands)
+            for position, blind in ((0, small_blind), (1, big_blind)):
+                blinds = Seat.objects.filter(game__in=new_hands, position=position)
+                Seat.bet(blinds, blind)
+                # whoever could not afford the blind is all-in.
+                Seat.all_in(blinds.filter(round_bet=0))
+        moved_count += len(moved)
+    return moved_count
+
+
+def _showdown(tables):
+    """
+    scores the hands of the tables and hands their pots over to the winners,
+        one UPDATE of the seats for all of them(see Game.award_pots).
+    the tables are left GameOver but not saved.
+    """
+    if not tables:
+        return
+    seats = {}
+    for pk, game_pk, position, hand_bet in Seat.objects.filter(game__in=tables).order_by(
+            "game", "position").values_list("pk", "game_id", "position", "hand_bet"):
+        seats.setdefault(game_pk, []).append((pk, position, hand_bet))
+    won = {}
+    seen = []
+    winners = []
+    for table in tables:
+        scores = table.showdown_scores()
+        table_seats = seats.get(table.pk, [])
+        folded = [x for x in range(0, table.total_num_of_players) if x not in scores]
+        winnings = distribute_pots(
+            calculate_pots([hand_bet for pk, position, hand_bet in table_seats], folded), scores)
+        for pk, position, hand_bet in table_seats:
+            won[pk] = winnings.get(position, 0)
+        seen.extend(table._get_user_guid(x) for x in scores)
+        winners.extend(table._get_user_guid(x) for x in showdown_winners(scores))
+        table.stage = GameStages.GameOver
+        table.player_to_action = ""
+    for pks in _batches(list(won), TABLE_BATCH_SIZE * 3):
+        Seat.objects.filter(pk__in=pks).update(
+            chips=F("chips") + Case(
+                *[When(pk=pk, then=Value(won[pk])) for pk in pks],
+                output_field=Seat._meta.get_field("chips")),
+            round_bet=0, hand_bet=0)
+    PlayerStats.increment(seen, showdowns_seen=1)
+    PlayerStats.increment(winners, showdowns_won=1)
+
+
+def _deal_seats(tables):
+    """creates the seats of new hands, with the chips the players have left."""
+    chips = dict(
+        ((game_pk, user_guid), chips) for game_pk, user_guid, chips in
+        TournamentEntry.objects.filter(game__in=tables).values_list(
+            "game_id", "user_guid", "chips"))
+    Seat.objects.bulk_create([
+        Seat(game=table, user_guid=user_guid, position=position,
+             chips=chips[(table.pk, user_guid)])
+        for table in tables
+        for position, user_guid in enumerate(table.player_guids.split("|"))
+    ])
+
+
+def start_next_hands(tournament):
+    """
+    once the hand of a table is over, the players' chips go back to their
+        entries, the busted players are out and the table starts over.
+    the button moves on: everybody moves a position down, so the big blind
+        of the hand over is the small blind of the next one(positions 0 and
+        1 post the blinds, see deal_next_stage).
+    returns the number of tables started over.
+    """
+    count = 0
+    for batch in _table_batches(tournament.tables.filter(stage=GameStages.GameOver)):
+        chips = dict(Seat.objects.filter(game__in=batch).values_list("user_guid", "chips"))
+        for user_guids in _batches(list(chips), ENTRY_BATCH_SIZE // 2):
+            tournament.entries.filter(user_guid__in=user_guids).update(chips=Case(
+                *[When(user_guid=x, then=Value(chips[x])) for x in user_guids],
+                output_field=TournamentEntry._meta.get_field("chips")
+            ))
+        busted = [user_guid for user_guid, x in chips.items() if x <= 0]
+        tournament.entries.filter(user_guid__in=busted).update(eliminated=True, game=None)
+        Seat.objects.filter(game__in=batch).delete()
+        for table in batch:
+            user_guids = table.player_guids.split("|")
+            _set_players(table, [
+                x for x in user_guids[1:] + user_guids[:1] if chips.get(x, 0) > 0])
+            table.pocket_cards = ""
+            table.community_cards = ""
+            table.betting_status = ""
+            table.stage = GameStages.Initial
+            table.version += 1
+        _bulk_update(batch, [
+            "player_guids", "total_num_of_players", "player_to_action",
+            "pocket_cards", "community_cards", "betting_status", "stage", "version"])
+        count += len(batch)
+    return count
+
+
+def rebalance(tournament):
+    """
+    breaks tables which are no longer needed and evens out the others,
+        moving as few players as possible.
+    only tables between hands(Initial) are touched.
+    NOTE: the tables' sizes(total_num_of_players) are counted by the
+        database, one row per size, and only tables which break, or have
+        to lose or gain players, are read. a balanced tournament costs
+        a single query however many tables it has.
+    returns the number of players moved.
+    """
+    tables = tournament.tables.filter(stage=GameStages.Initial)
+    with transaction.atomic():
+        sizes = dict(tables.order_by().values_list("total_num_of_players").annotate(Count("pk")))
+        num_of_tables = sum(sizes.values())
+        num_of_players = sum(size * count for size, count in sizes.items())
+        if not num_of_tables:
+            return 0
+        num_needed = -(-num_of_players // tournament.table_size)
+        base, extra = divmod(num_of_players, num_needed) if num_needed else (0, 0)
+
+        # the fullest tables are kept, the first extra of them with a player
+        # more than the others, the rest are broken. tables of the same size
+        # are taken by primary key, only those off their target are read.
+        targets = []
+        position = 0
+        for size in sorted(sizes, reverse=True):
+            for target, first, last in (
+                    (base + 1, 0, extra),
+                    (base, extra, num_needed),
+                    (None, num_needed, num_of_tables)):
+                start, stop = max(first, position), min(last, position + sizes[size])
+                if start >= stop or target == size:
+                    continue
+                for table in tables.select_for_update().filter(
+                        total_num_of_players=size).order_by("pk")[
+                        start - position:stop - position]:
+                    targets.append((table, target))
+            position += sizes[size]
+        kept = [(table, target) for table, target in targets if target is not None]
+        broken = [table for table, target in targets if target is None]
+        players = dict((table.pk, [x for x in table.player_guids.split("|") if x])
+                       for table, target in targets)
+
+        movers = [x for table in broken for x in players[table.pk]]
+        for table, target in kept:
+            while len(players[table.pk]) > target:
+                movers.append(players[table.pk].pop())
+        moved_players = {}
+        for table, target in kept:
+            while len(players[table.pk]) < target:
+                user_guid = movers.pop()
+                players[table.pk].append(user_guid)
+                moved_players[user_guid] = table.pk
+
+        changed = [table for table, target in kept]
+        for table in changed:
+            _set_players(table, players[table.pk])
+            table.version += 1
+        for batch in _batches(changed, TABLE_BATCH_SIZE):
+            _bulk_update(batch, [
+                "player_guids", "total_num_of_players", "player_to_action", "version"])
+        _move_entries(tournament, moved_players)
+        for batch in _batches(broken, TABLE_BATCH_SIZE):
+            Game.objects.filter(pk__in=[table.pk for table in batch]).delete()
+    return len(moved_players)
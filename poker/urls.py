@@ -22,4 +22,7 @@ urlpatterns = [
     url(r'^game/status/?', views.game_status, name='game_status'),
     url(r'^user/action/?', views.user_action, name='user_action'),
     url(r'^join/?', views.join_game, name='join'),
+    url(r'^player/stats/?', views.player_stats, name='player_stats'),
+    url(r'^leaderboard/?', views.leaderboard, name='leaderboard'),
+    url(r'^equity/?', views.equity, name='equity'),
 ]
@@ -8,10 +8,16 @@ if needed.
 WARNING: cheating of the game is currently expected in every possible way
 """
 
-from django.http import HttpResponse
-from poker.models import Game, GameStages, User
+from django.http import HttpResponse, StreamingHttpResponse
+from poker.models import BetTooSmall, Game, GameStages, NotEnoughChips, PlayerStats, User
 from django.views.decorators.http import require_POST, require_GET
 from django.views.decorators.csrf import csrf_exempt
+from django.core.cache import cache
+from django.db import transaction
+from poker.querybudget import query_budget
+from poker import bots, snapshot
+from poker.equity import EquityError, check_ranges, equity_progress
+from poker.ranges import RangeError, parse_board, parse_range
 import json
 import uuid
 from django.http import HttpResponse
@@ -33,7 +39,13 @@ def _json_success_response(message="Unknown Error"):
 # TODO: still need to implement key function list:
 #    1. game ending: scoring best hands.
 
+# at most, for the poll which gets to the showdown: the game, the game again
+# locked, saving it, the hand bets, paying out the seats, showdowns seen,
+# showdowns won and the seats for the status. a poll of a game which has
+# nothing to do is the game only.
+@query_budget(8)
 @require_GET
+@transaction.atomic
 def game_status(request):
     """
     returns the current status. of a specific game,
@@ -43,6 +55,8 @@ def game_status(request):
         1. if no user specified, create user
         2. if no game specified, join or create game.
         3. pushes the game into the next stage if ready
+    if since_version(the "version" of a previous response) is provided,
+        only the fields changed since then are returned(with "delta": True).
     # TODO: remove side effects in v2.
     """
     user_guid = request.GET.get("user_guid", None)
@@ -53,12 +67,102 @@ def game_status(request):
     #       now just return the first non-over game.
     #       if there is no such game, create new one.
     game_guid = request.GET.get("game_guid", None)
-    hard_code = {
-    return _json_response(hard_code)
-#    return _json_response()
- #   return _json_response(game_status_helper(game_guid, user_guid))
+    since_version = request.GET.get("since_version", None)
+    if game_guid:
+        try:
+            game = Game.objects.get(guid=game_guid)
+        except Game.DoesNotExist:
+            return _json_error_response("Invalid game guid.")
+        if _is_unchanged(game, since_version):
+            return _json_response(
+                {"game_guid": game.guid, "version": game.version, "delta": True})
+        status = _build_game_status(game, user_guid)
+    else:
+        status = game_status_helper(game_guid, user_guid)
+        if isinstance(status, HttpResponse):
+            # error response.
+            return status
+    return _json_response(_game_status_delta(status, user_guid, since_version))
+
+# a client lagging behind more versions than this gets a full snapshot,
+# replaying that many changes is not cheaper than re-sending everything.
+MAX_DELTA_VERSION_GAP = 20
+# how long a sent game status is kept around to diff against.
+GAME_STATUS_CACHE_TIMEOUT = 60 * 10
+# fields which only ever grow within a game, for those only the new
+# tail is sent, for example: the turn card instead of all 4 community cards.
+APPEND_ONLY_STATUS_FIELDS = ("community_cards",)
+
+# TODO: in v2, serve polls from an async server. Django 1.9 on python 2 has
+#       no async views, every poll holds a worker until it's answered,
+#       _is_unchanged only makes that as short as it gets.
+def _is_unchanged(game, since_version):
+    """
+    True if the game is still at since_version and has nothing to do,
+        in which case there is nothing to build, cache or send but the version.
+    NOTE: most polls are from clients waiting for somebody else to act,
+          this keeps them cheap.
+    """
+    try:
+        since_version = int(since_version)
+    except (TypeError, ValueError):
+        return False
+    if game.version != since_version or game.stage == GameStages.Initial or \
+            game._is_next_stage_ready():
+        return False
+    # in case the bot's worker is gone, e.g. after a restart.
+    bots.play_if_bot_to_act(game)
+    return True
+
+def _game_status_cache_key(game_guid, user_guid, version):
+    return "game_status:%s:%s:%s" % (game_guid, user_guid, version)
+
+def _game_status_delta(game_status, user_guid, since_version=None):
+    """
+    returns only the part of game_status that changed since since_version,
+        which is the last version the client has seen.
+        falls back to the full game_status(with "delta": False)
+        if since_version is missing, invalid, too old or no longer cached.
+        a key which is gone since then is sent as None, e.g. pot_value
+        once a tournament table is back to Initial.
+    NOTE: the status is cached per user since pocket cards are private.
+    NOTE: the cache has to be shared by all the workers(see CACHES in settings),
+          a poll reaching a worker which didn't send since_version is a miss.
+          every full status is cached, which is one cache.set per poll
+          that isn't answered by _is_unchanged.
+    """
+    game_guid = game_status["game_guid"]
+    version = game_status["version"]
+    cache.set(
+        _game_status_cache_key(game_guid, user_guid, version),
+        game_status, GAME_STATUS_CACHE_TIMEOUT)
 
-    
+    full_status = dict(game_status, delta=False)
+    try:
+        since_version = int(since_version)
+    except (TypeError, ValueError):
+        return full_status
+    if not 0 <= version - since_version <= MAX_DELTA_VERSION_GAP:
+        return full_status
+    previous = cache.get(_game_status_cache_key(game_guid, user_guid, since_version))
+    if previous is None:
+        return full_status
+
+    delta = {"game_guid": game_guid, "version": version, "delta": True}
+    for key, value in game_status.items():
+        previous_value = previous.get(key)
+        if value == previous_value:
+            continue
+        if key in APPEND_ONLY_STATUS_FIELDS and previous_value and \
+                value.startswith(previous_value):
+            # only the newly dealt part, 'h3|d4|c6' -> 'h3|d4|c6|s7' gives 's7'
+            delta[key + "_added"] = value[len(previous_value):].lstrip("|")
+        else:
+            delta[key] = value
+    for key in previous:
+        if key not in game_status:
+            delta[key] = None
+    return delta
 
 def game_status_helper(game_guid, user_guid):
     game = None
@@ -70,10 +174,11 @@ def game_status_helper(game_guid, user_guid):
         except:
             return _json_error_response("Invalid game guid.")
     else:
-        # join the top game which has not started yet.
-        games = Game.objects.filter(stage=GameStages.Initial)
-        if games:
-            game = games[0]
+        # join the top game which has not started yet,
+        # tournament tables are seated by the tournament.
+        game = Game.objects.select_for_update().filter(
+            stage=GameStages.Initial, tournament__isnull=True).first()
+        if game:
             game.total_num_of_players += 1
             game.player_guids += "|" + str(user_guid)
         # if no such game, create new game.
@@ -82,10 +187,25 @@ def game_status_helper(game_guid, user_guid):
             game.total_num_of_players = 1
             game.player_guids = user_guid
             game.player_to_action = user_guid
-        game.save()
+        bots.fill_with_bots(game)
+        if not game._is_next_stage_ready():
+            # otherwise moving to the next stage below saves the join as well.
+            game.save()
 
+    return _build_game_status(game, user_guid, locked=True)
+
+def _build_game_status(game, user_guid, locked=False):
+    if not locked and game.pk is not None and \
+            (bots.needs_bots(game) or game._is_next_stage_ready()):
+        # the game is about to change: it's locked and read again first,
+        # so concurrent polls and actions don't save different games
+        # as the same version.
+        game = Game.objects.select_for_update().get(pk=game.pk)
+    # bots take the empty seats of games waiting for players too long.
+    bots.fill_with_bots(game)
     # here is where the game serving cards and compare hands.
     game = game.move_to_next_stage_if_ready()
+    bots.play_if_bot_to_act(game)
 
     # construct game status.
     game_status = {}
@@ -96,10 +216,30 @@ def game_status_helper(game_guid, user_guid):
     # NOTE: front-end would ask user to act with action option list
     #       if user has matching user_guid
     game_status["player_to_action"] = game.player_to_action
+    game_status["betting_status"] = game.betting_status
     game_status["game_guid"] = str(game.guid)
+    game_status["version"] = game.version
+    seats = snapshot.get_seats(game)
+    if game.stage != GameStages.Initial:
+        # chips are only dealt with the pocket cards.
+        pot_value = 0
+        for seat_user_guid, position, chips, round_bet, hand_bet, voluntarily_played in seats:
+            pot_value += hand_bet
+            if seat_user_guid == user_guid:
+                game_status["player_stake"] = chips
+        game_status["pot_value"] = pot_value
+    # the next poll of the game doesn't read its seats, unless it changed in the meantime.
+    transaction.on_commit(lambda: snapshot.remember(game, seats))
     return game_status
 
+# at most, for a call preflop with less chips than needed: the game locked,
+# the round bets, the call, the all-in instead(two statements,
+# see Seat.all_in), voluntarily_played, vpip_hands and saving the game.
+# NOTE: a bot acting next does so once this transaction commits, its
+#       queries are not counted here(see bots.play_if_bot_to_act).
+@query_budget(8)
 @require_POST
+@transaction.atomic
 def user_action(request):
     """
     Responsible for react to an action
@@ -113,16 +253,33 @@ def user_action(request):
     game_guid = request.POST.get("game_guid", None)
     user_guid = request.POST.get("user_guid", None)
     try:
-        game = Game.objects.get(guid=game_guid)
+        # locked until the action is saved, so two actions can't both
+        # pass the turn check or save different games as the same version.
+        game = Game.objects.select_for_update().get(guid=game_guid)
     except:
         return _json_error_response("No such game.")
     action_type = request.POST.get("action_type", None)
+    try:
+        amount = int(request.POST.get("amount", 0))
+    except ValueError:
+        return _json_error_response("Invalid amount.")
+    if amount < 0:
+        return _json_error_response("Invalid amount.")
     # TODO: log this in v2 as it indicates lack of restriction in front-end.
     if game.player_to_action != user_guid:
         return _json_error_response("Not your turn.")
-    game.record_action(user_guid, action_type)
+    try:
+        game.record_action(user_guid, action_type, amount)
+    except NotEnoughChips:
+        return _json_error_response("Not enough chips.")
+    except BetTooSmall:
+        return _json_error_response("Bet too small.")
+    bots.play_if_bot_to_act(game)
     return _json_success_response("Action completed.")
 
+# the game(created if missing) and the user, then at most what game_status
+# runs after reading the game, 7 queries.
+@query_budget(9)
 @csrf_exempt
 def join_game(request):
     if request.method == "OPTIONS": 
@@ -138,13 +295,76 @@ def join_game(request):
         return _json_error_response("Add game guid")
     if not user_name:
         return _json_error_response("Add name please")
-    game, created = Game.objects.get_or_create(guid=game_guid)
-    user = User(username=user_name, guid=uuid.uuid4())
-    user.save()
-    game_status = game_status_helper(game.guid, user.guid)
+    with transaction.atomic():
+        game, created = Game.objects.get_or_create(guid=game_guid)
+        user = User(username=user_name, guid=uuid.uuid4())
+        user.save()
+        game_status = _build_game_status(game, user.guid)
     game_status['player_guid'] = str(user.guid)
     return _json_response(game_status)
 
+@query_budget(1)
+@require_GET
+def player_stats(request):
+    """returns the stats of the given user."""
+    user_guid = request.GET.get("user_guid", None)
+    try:
+        stats = PlayerStats.objects.get(user_guid=user_guid)
+    except PlayerStats.DoesNotExist:
+        return _json_error_response("No stats for this user.")
+    return _json_response(stats.as_dict())
+
+# counters a leaderboard can be ranked by, all of them indexed.
+LEADERBOARD_ORDERS = ("showdowns_won", "hands_played")
+LEADERBOARD_SIZE = 20
+
+@query_budget(1)
+@require_GET
+def leaderboard(request):
+    """
+    returns the top players by the given counter(order_by),
+        showdowns won by default.
+    """
+    order_by = request.GET.get("order_by", LEADERBOARD_ORDERS[0])
+    if order_by not in LEADERBOARD_ORDERS:
+        return _json_error_response("Can't rank players by this.")
+    top = PlayerStats.objects.order_by("-" + order_by)[:LEADERBOARD_SIZE]
+    return _json_response({"players": [stats.as_dict() for stats in top]})
+
+@query_budget(1)
+@require_GET
+def equity(request):
+    """
+    streams hero's equity against villain's range, one JSON object per line,
+        each estimate more accurate than the one before(see poker.equity).
+    hero and villain are ranges(see poker.ranges), e.g. "QQ+, AKs",
+    the board is either given(board=hQ|d7|c2) or that of a game(game_guid).
+    """
+    game_guid = request.GET.get("game_guid", None)
+    if game_guid:
+        try:
+            board = Game.objects.get(guid=game_guid).community_cards
+        except Game.DoesNotExist:
+            return _json_error_response("Invalid game guid.")
+        try:
+            board = parse_board(board)
+        except RangeError:
+            # NOTE: games dealt before FrenchDeck lost its bogus '1' rank
+            #       may have one on the board.
+            return _json_error_response(
+                "The game was dealt from the old 56 card deck, its board can't be used: %s" % board)
+    try:
+        # checked before streaming, errors can't be sent once it started.
+        if not game_guid:
+            board = parse_board(request.GET.get("board", ""))
+        hero = parse_range(request.GET.get("hero", ""), board)
+        villain = parse_range(request.GET.get("villain", ""), board)
+        check_ranges(hero, villain)
+    except (RangeError, EquityError) as e:
+        return _json_error_response(str(e))
+    lines = (json.dumps(x) + "\n" for x in equity_progress(hero, villain, board))
+    return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
 """
 TODO: formalize the format in design doc.
 THis is the format back-end is currently generating.